@@ -0,0 +1,114 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from utils_mtmc.synthetic_mtmc import generate_synthetic_mtmc_files
+from utils_mtmc.stage_profiling import enable_profiling, reset_profiling, get_profiling_report
+from run_distance_by_plane_in_switzerland_in_2015 import run_distance_by_plane_in_switzerland_in_2015
+
+# Benchmark of the whole computation on synthetic data (see utils_mtmc/synthetic_mtmc.py), at several scales
+# (number of persons in zielpersonen.csv; the survey 2015 contains about 57 000 persons). For each scale:
+# - the time of the first run, which converts the input files (see utils_mtmc/mtmc_cache.py),
+# - the best time of the following runs (end-to-end),
+# - the time, memory and number of rows of each stage, in a run with profiling (see utils_mtmc/stage_profiling.py),
+# - the peak resident memory of the process (each scale runs in its own process).
+# The results at the reference scale are compared to frozen results, to check that optimizations do not change them.
+default_scales = [17000, 100000, 1000000]
+reference_scale = 17000
+path_2_benchmark = os.path.join('..', 'data', 'benchmark')
+path_2_reference_results = os.path.join(path_2_benchmark, 'reference_results.json')
+relative_tolerance = 1e-9
+
+
+def run_benchmark(scales=None, nb_of_repetitions=3, figures=False, update_reference=False):
+    if scales is None:
+        scales = default_scales
+    benchmark_results = []
+    for nb_of_persons in scales:
+        path_2_input = os.path.join(path_2_benchmark, 'input_' + str(nb_of_persons))
+        if not os.path.isfile(os.path.join(path_2_input, 'reisenmueb.csv')):
+            print('Generating synthetic data for', nb_of_persons, 'persons')
+            generate_synthetic_mtmc_files(path_2_input, nb_of_persons=nb_of_persons)
+        # Each scale in a new process, so that the peak of memory is the one of this scale
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            benchmark_result = executor.submit(benchmark_scale, nb_of_persons, path_2_input, nb_of_repetitions,
+                                               figures).result()
+        print(nb_of_persons, 'persons:', round(benchmark_result['end_to_end_in_s'], 3), 's (first run:',
+              round(benchmark_result['first_run_in_s'], 3), 's), peak memory:',
+              benchmark_result['peak_rss_in_mb'], 'MB')
+        benchmark_results.append(benchmark_result)
+    with open(os.path.join(path_2_benchmark, 'benchmark_results.json'), 'w') as benchmark_file:
+        json.dump(benchmark_results, benchmark_file, indent=4)
+    if reference_scale in scales:
+        check_reference_results(os.path.join(path_2_benchmark, 'output_' + str(reference_scale)), update_reference)
+    return benchmark_results
+
+
+def benchmark_scale(nb_of_persons, path_2_input, nb_of_repetitions, figures):
+    path_2_output = os.path.join(path_2_benchmark, 'output_' + str(nb_of_persons))
+    os.makedirs(path_2_output, exist_ok=True)
+    # First run, with the conversion of the input files
+    shutil.rmtree(os.path.join(path_2_input, 'cache'), ignore_errors=True)
+    first_run_in_s = time_run(path_2_input, path_2_output, figures)
+    end_to_end_in_s = min(time_run(path_2_input, path_2_output, figures) for _ in range(nb_of_repetitions))
+    # Run with profiling by stage (slower, because of tracemalloc)
+    enable_profiling()
+    reset_profiling()
+    time_run(path_2_input, path_2_output, figures)
+    stages = get_profiling_report()['stages']
+    return {'nb_of_persons': nb_of_persons,
+            'first_run_in_s': first_run_in_s,
+            'end_to_end_in_s': end_to_end_in_s,
+            'peak_rss_in_mb': max(stage['peak_rss_in_mb'] or 0 for stage in stages),
+            'stages': stages}
+
+
+def time_run(path_2_input, path_2_output, figures):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        run_distance_by_plane_in_switzerland_in_2015(outputs=('json',), figures=figures, path_2_input=path_2_input,
+                                                     path_2_output=path_2_output)
+    return time.perf_counter() - start
+
+
+def check_reference_results(path_2_output, update_reference):
+    with open(os.path.join(path_2_output, 'distance_by_plane_by_age.json'), 'r') as results_file:
+        results = json.load(results_file)
+    if update_reference or not os.path.isfile(path_2_reference_results):
+        with open(path_2_reference_results, 'w') as reference_file:
+            json.dump(results, reference_file, indent=4)
+        print('Reference results saved in', path_2_reference_results)
+        return
+    with open(path_2_reference_results, 'r') as reference_file:
+        reference_results = json.load(reference_file)
+    differences = get_differences(reference_results, results)
+    if differences:
+        raise Exception('Results differ from the reference results:\n' + '\n'.join(differences))
+    print('Results are the same as the reference results')
+
+
+def get_differences(reference, results, path=''):
+    if isinstance(reference, dict):
+        if not isinstance(results, dict) or set(reference) != set(results):
+            return [path + ': different keys']
+        return [difference for key in reference
+                for difference in get_differences(reference[key], results[key], path + '/' + key)]
+    if abs(results - reference) > relative_tolerance * abs(reference):
+        return [path + ': ' + str(results) + ' instead of ' + str(reference)]
+    return []
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark on synthetic data')
+    parser.add_argument('--scales', nargs='+', type=int, default=default_scales,
+                        help='numbers of persons (default: ' + ' '.join(str(scale) for scale in default_scales) + ')')
+    parser.add_argument('--repetitions', type=int, default=3, help='number of timed runs by scale (default: 3)')
+    parser.add_argument('--figures', action='store_true', help='also generate the figures')
+    parser.add_argument('--update-reference', action='store_true',
+                        help='replace the reference results by the results of this benchmark')
+    args = parser.parse_args()
+    run_benchmark(args.scales, args.repetitions, args.figures, args.update_reference)
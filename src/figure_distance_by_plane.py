@@ -0,0 +1,147 @@
+import matplotlib
+import pandas as pd
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# Version of the style of the figures, to be incremented when the code drawing the figures changes, so that the
+# figures in the cache are drawn again
+figure_style_version = 1
+default_languages = ('fr', 'de', 'en')
+dict_title = {'fr': "Distance totale$^1$ des voyages en avion par personne\nselon l'âge et le motif, en 2015",
+              'en': 'Total distance$^1$ of trips by plane per person\nby age and purpose in 2015',
+              'de': 'Gesamtdistanz$^1$ der Flugreisen pro Person\nnach Alter und Zweck, 2015'}
+dict_bottom_text = {'fr': '$^1$ Voyages aller et retour et distances sur place.\n\n'
+                          'Base: 17 054 personnes cible interrogées dans le module supplémentaire\n"Voyages avec '
+                          'nuitées", avec indication valable de la distance\n\n'
+                          'Source: OFS, ARE - Microrecensement mobilité et transports (MRMT)',
+                    'en': '$^1$ Outward and return journeys and distances at destination.\n\n'
+                          'Basis: 17 054 persons who were asked about trips with '
+                          'overnight stays and could provide\n'
+                          'valid information about the distance covered\n\n'
+                          'Source: FSO, ARE - Mobility and Transport Microcensus (MTMC)',
+                    'de': '$^1$ Hinreise(n), Rückreise(n) und Distanzen vor Ort.\n\n'
+                          'Basis: 17 054 Zielpersonen die zum Zusatzmodul Reisen mit Übernachtungen befragt '
+                          'wurden,\nmit gültigen Angaben zur Distanz\n\n'
+                          'Quelle: BFS, ARE – Mikrozensus Mobilität und Verkehr (MZMV)'}
+# Horizontal position of the text below the figure, in km
+dict_bottom_text_x = {'fr': -1850,
+                      'de': -2450,
+                      'en': -2300}
+dict_categories = {'en': ['Private trips', 'Business trips', 'Other'],
+                   'fr': ["Voyages d'ordre privé", "Voyages d'affaires", 'Autres'],
+                   'de': ['Privatreisen', 'Geschäftsreisen', 'übrige']}
+fso_colors = ['#A1D6EF', '#F07E00', '#CFD0D0']
+dict_y_ticks = {'en': ['6-17 years', '18-24 years', '25-44 years', '45-64 years', '65-79 years',
+                       '80 years and over'],
+                'fr': ['6-17 ans', '18-24 ans', '25-44 ans', '45-64 ans', '65-79 ans', '80 ans et plus'],
+                'de': ['6-17 Jahre', '18-24 Jahre', '25-44 Jahre', '45-64 Jahre', '65-79 Jahre',
+                       '80 Jahre und mehr']}
+
+
+def generate_figure_by_age_by_trip_category(output_by_age_as_df_private, output_by_age_as_df_business,
+                                            output_by_age_as_df_other, languages=default_languages,
+                                            path_2_output=None, max_workers=None):
+    # Figures are drawn in parallel (one process by language) and only if the data or the style changed since the
+    # last time. The last drawn figure of each language is kept in a cache (folder .figure_cache in the output folder),
+    # named by the language and the hash of its data and style.
+    if path_2_output is None:
+        path_2_output = os.path.join('..', 'data', 'output')
+    path_2_cache = os.path.join(path_2_output, '.figure_cache')
+    os.makedirs(path_2_cache, exist_ok=True)
+    df_by_age = pd.concat([output_by_age_as_df_private.iloc[:, 0],
+                           output_by_age_as_df_business.iloc[:, 0],
+                           output_by_age_as_df_other.iloc[:, 0]], axis=1)
+    path_2_cached_figures = {}
+    figures_to_draw = []
+    for language in languages:
+        path_2_cached_figures[language] = os.path.join(path_2_cache,
+                                                       language + '_' + get_figure_hash(df_by_age, language) + '.png')
+        if not os.path.isfile(path_2_cached_figures[language]):
+            figures_to_draw.append((df_by_age, language, path_2_cached_figures[language]))
+    if len(figures_to_draw) == 1 or max_workers == 1:
+        for figure_to_draw in figures_to_draw:
+            draw_figure_by_age_by_trip_category(*figure_to_draw)
+    elif figures_to_draw:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            list(executor.map(draw_figure_by_age_by_trip_category, *zip(*figures_to_draw)))
+    for language in languages:
+        shutil.copyfile(path_2_cached_figures[language],
+                        os.path.join(path_2_output, 'distance_by_plane_by_age_' + language + '.png'))
+        # Older figures of this language are removed, so that the cache does not grow
+        for file_name in os.listdir(path_2_cache):
+            if file_name.startswith(language + '_') and \
+                    os.path.join(path_2_cache, file_name) != path_2_cached_figures[language]:
+                os.remove(os.path.join(path_2_cache, file_name))
+
+
+def get_figure_hash(df_by_age, language):
+    figure_description = get_figure_description(language)
+    figure_description['data'] = df_by_age.to_csv()
+    return hashlib.sha256(json.dumps(figure_description, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def get_figure_description(language):
+    # Everything defining the figure, except the data
+    return {'language': language,
+            'title': dict_title[language],
+            'bottom_text': dict_bottom_text[language],
+            'bottom_text_x': dict_bottom_text_x[language],
+            'categories': dict_categories[language],
+            'colors': fso_colors,
+            'y_ticks': dict_y_ticks[language],
+            'figure_style_version': figure_style_version,
+            'matplotlib_version': matplotlib.__version__}
+
+
+def draw_figure_by_age_by_trip_category(df_by_age, language, path_2_figure):
+    df_by_age = df_by_age.set_axis(dict_categories[language], axis=1)
+    figure = Figure()
+    FigureCanvasAgg(figure)
+    ax = figure.add_subplot(111)
+    df_by_age.plot.barh(stacked=True, color=fso_colors, ax=ax)
+    ax.invert_yaxis()
+    ax.set_ylabel('')
+    ax.set_yticks(range(len(dict_y_ticks[language])))
+    ax.set_yticklabels(dict_y_ticks[language])
+    ax.set_title(dict_title[language])
+    ax.legend(loc=4, mode='expand', ncol=3, bbox_to_anchor=(0., -0.2, 1., 0.102))
+    ax.xaxis.grid(True)
+    # Add "km" at the end of x-axis
+    ticklabelpad = matplotlib.rcParams['xtick.major.pad']
+    ax.annotate('km', xy=(1, 0), xytext=(5, -2 * ticklabelpad), ha='left', va='top', xycoords='axes fraction',
+                textcoords='offset points')
+    # Add total km at the end of the bars
+    i = 0
+    for total_km in \
+            df_by_age[dict_categories[language][0]] + \
+            df_by_age[dict_categories[language][1]] + \
+            df_by_age[dict_categories[language][2]]:
+        ax.text(total_km + 100, i + 0.07, str(round(total_km)), fontweight='bold')
+        i += 1
+    # Remove top and right axis
+    ax.spines['right'].set_visible(False)
+    ax.spines['top'].set_visible(False)
+    # Add values in the stack bars
+    labels = []
+    for trip_category in df_by_age.columns:
+        for age_category in df_by_age.index:
+            label = int(round(df_by_age[trip_category][age_category]))
+            labels.append(label)
+    patches = ax.patches
+    for label, rect in zip(labels, patches):
+        width = rect.get_width()
+        if width > 700:
+            x = rect.get_x()
+            y = rect.get_y()
+            height = rect.get_height()
+            ax.text(x+width/2., y+height/2., label, ha='center', va='center')
+    # Add text below the figure
+    ax.text(dict_bottom_text_x[language], 8.5, dict_bottom_text[language], ha='left')
+    # Write to a temporary file first, so that an interrupted drawing is never taken from the cache
+    figure.savefig(path_2_figure + '.tmp', bbox_inches='tight', format='png')
+    os.replace(path_2_figure + '.tmp', path_2_figure)
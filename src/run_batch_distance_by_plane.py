@@ -0,0 +1,57 @@
+import pandas as pd
+import os
+from concurrent.futures import ProcessPoolExecutor
+from run_distance_by_plane_in_switzerland_in_2015 import get_input_data, compute_distance_by_plane
+
+# Each job is a dictionary with the year of the MTMC, the name of the variant, and optionally the folder of the
+# input files (path_2_input, for scenarios) and parameters of compute_distance_by_plane (e.g., excluded_hhnr,
+# age_bins and age_labels, variance_method, nb_of_replicates) or chunksize (streaming mode, see
+# get_input_data).
+default_jobs = [{'year': 2015, 'variant': 'reference'}]
+input_data_by_files = {}  # Input data already loaded in the (worker) process, by year and folder of the input files
+
+
+def run_batch_distance_by_plane(jobs=None, path_2_output=None, max_workers=None):
+    if jobs is None:
+        jobs = default_jobs
+    if path_2_output is None:
+        path_2_output = os.path.join('..', 'data', 'output', 'distance_by_plane_batch.csv')
+    # Convert the input files once (see utils_mtmc/mtmc_cache.py), before the workers read them in parallel
+    for year, path_2_input in sorted(set((job['year'], job.get('path_2_input')) for job in jobs), key=str):
+        get_input_data(year, path_2_input)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(run_job, jobs))
+    df_results = pd.concat(results, ignore_index=True)
+    df_results.to_csv(path_2_output, index=False)
+    return df_results
+
+
+def run_job(job):
+    year = job['year']
+    path_2_input = job.get('path_2_input')
+    chunksize = job.get('chunksize')
+    parameters = {key: value for key, value in job.items()
+                  if key not in ['year', 'variant', 'path_2_input', 'chunksize']}
+    if chunksize is not None:
+        # In streaming mode, trips are read again for each job
+        df_zp, df_overnight_trips = get_input_data(year, path_2_input, chunksize)
+    else:
+        # Jobs using the same input files share the parsed data (memory-mapped from the cache)
+        if (year, path_2_input) not in input_data_by_files:
+            input_data_by_files[(year, path_2_input)] = get_input_data(year, path_2_input)
+        df_zp, df_overnight_trips = input_data_by_files[(year, path_2_input)]
+    output_total, output_by_age, nb_of_obs = compute_distance_by_plane(df_zp, df_overnight_trips, year,
+                                                                       **parameters)
+    output_total.index = ['Total']
+    output = pd.concat([output_total, output_by_age])
+    # One row by category of trips (variable) and age category
+    output = pd.concat({name_variable: output[name_variable] for name_variable in output.columns.unique(level=0)},
+                       names=['variable', 'Age category']).reset_index()
+    output.insert(0, 'year', year)
+    output.insert(1, 'variant', job['variant'])
+    output['nb_of_obs'] = nb_of_obs
+    return output
+
+
+if __name__ == '__main__':
+    run_batch_distance_by_plane()
@@ -1,298 +1,489 @@
-from utils_mtmc.get_mtmc_files import *
+from utils_mtmc.get_mtmc_files import get_zp, get_overnight_trips, get_mtmc_year, get_sha256_of_mtmc_files, \
+    default_path_2_input
+from utils_mtmc.mtmc_cache import cache_folder_name, read_cached_mtmc_file, read_cached_mtmc_file_in_chunks, \
+    replace_missing_values, write_cache
 import numpy as np
 import pandas as pd
+import argparse
+import json
 import os
-import matplotlib.pyplot as plt
-
-
-def run_distance_by_plane_in_switzerland_in_2015():
-    df_zp = get_zp_renamed()
-    # select only people who were asked questions about trips with overnights (module 1b, encoded 2)
-    df_zp = df_zp[df_zp['module_attributed_to_the_respondent'] == 2]
-    df_zp.drop(columns=['module_attributed_to_the_respondent'], inplace=True)
-    # select only people who said the number of trips with overnights they made
-    df_zp['with_trips'] = df_zp['nb_trips_with_overnights'] > 0
-    df_zp = df_zp[~df_zp['nb_trips_with_overnights'] < 0]
-    # sum of weights of the declared trips, including those without details, in particular distance
-    weight_declared_trips = df_zp[df_zp['with_trips']]['WP'].sum()
-    # select overnight trips whose distance is known
-    df_overnight_trips = get_overnight_trips_in_2015_renamed()  # contains all trips with overnights
-    df_overnight_trips = df_overnight_trips[df_overnight_trips['trip_distance'] >= 0]  # only trips with valid distance
-    df_overnight_trips = add_aggregate_goal_to_overnight_trips(df_overnight_trips)  # add info about aggregated goals
-    # get number of detailed trips (with distance) by person
-    df_overnight_trips_count_nb = df_overnight_trips[['HHNR', 'trip_distance']].groupby('HHNR').count()
-    df_overnight_trips_count_nb = df_overnight_trips_count_nb.rename(columns={'trip_distance': 'nb_detailed_trips'})
-    df_zp = pd.merge(df_zp, df_overnight_trips_count_nb,
-                     left_on='HHNR', right_index=True, how='left')
-    # get total distance per person by plane
-    df_overnight_trips['trip_distance_by_plane'] = \
-        df_overnight_trips['trip_distance'] * (df_overnight_trips['main_transport_mode'] == 17)
-    df_overnight_trips['trip_distance_by_plane_private'] = \
-        df_overnight_trips['trip_distance'] * (df_overnight_trips['main_transport_mode'] == 17) \
-        * (df_overnight_trips['trip_goal_agg'] == 1)
-    df_overnight_trips['trip_distance_by_plane_business'] = \
-        df_overnight_trips['trip_distance'] * (df_overnight_trips['main_transport_mode'] == 17) \
-        * (df_overnight_trips['trip_goal_agg'] == 2)
-    df_overnight_trips['trip_distance_by_plane_other'] = \
-        df_overnight_trips['trip_distance'] * (df_overnight_trips['main_transport_mode'] == 17) \
-        * (df_overnight_trips['trip_goal_agg'] == 3)
-    df_overnight_trips_count_sum = df_overnight_trips[['HHNR', 'trip_distance_by_plane',
-                                                       'trip_distance_by_plane_private',
-                                                       'trip_distance_by_plane_business',
-                                                       'trip_distance_by_plane_other']].groupby('HHNR').sum()
-    df_overnight_trips_count_sum = \
-        df_overnight_trips_count_sum.rename(columns={'trip_distance_by_plane': 'total_distance',
-                                                     'trip_distance_by_plane_private': 'total_distance_private',
-                                                     'trip_distance_by_plane_business': 'total_distance_business',
-                                                     'trip_distance_by_plane_other': 'total_distance_other'})
-    df_zp_with_trips_temp = pd.merge(df_zp[df_zp['with_trips']], df_overnight_trips_count_sum,
-                                     left_on='HHNR', right_index=True, how='inner')
-    df_zp = pd.concat([df_zp[~df_zp['with_trips']], df_zp_with_trips_temp])
-    # extrapolation for all trips based on declared trips
-    df_zp['total_distance_extrapolated'] = \
-        df_zp['total_distance'] * df_zp['nb_trips_with_overnights'] / \
-        df_zp['nb_detailed_trips']
-    df_zp['total_distance_extrapolated_private'] = \
-        df_zp['total_distance_private'] * df_zp['nb_trips_with_overnights'] / \
-        df_zp['nb_detailed_trips']
-    df_zp['total_distance_extrapolated_business'] = \
-        df_zp['total_distance_business'] * df_zp['nb_trips_with_overnights'] / \
-        df_zp['nb_detailed_trips']
-    df_zp['total_distance_extrapolated_other'] = \
-        df_zp['total_distance_other'] * df_zp['nb_trips_with_overnights'] / \
-        df_zp['nb_detailed_trips']
-    # Remove people who said they did a trip, but whose distance are not valid
-    # For HHNR=333950, the distance is known, but not the country of destination.
-    # For HHNR=488907, the destination is known but is the same as home.
-    df_zp = df_zp[~df_zp['HHNR'].isin([333950, 488907])]
-    nb_of_obs = len(df_zp)
+from utils_mtmc.aggregate_trips import get_sums_by_person_and_category, get_codes_and_values
+from utils_mtmc.weighted_statistics import get_weighted_averages_and_stds_by_group, get_group_codes, get_sums_by_cell
+from utils_mtmc.replicate_weights import get_replicate_weighted_averages_and_stds_in_total_and_by_group, \
+    get_half_widths, set_replicate_arrays, get_replicate_weighted_sums
+from utils_mtmc.weighted_cube import get_weighted_cube, save_weighted_cube
+from utils_mtmc.stage_store import define_stage, get_stage_result, get_sha256_of_files, are_files_unchanged, \
+    default_path_2_store, default_max_size_in_bytes
+from utils_mtmc.stage_profiling import profile_stage, enable_profiling, is_profiling_enabled, save_profiling_report
+
+# Aggregated goals of trips (see add_aggregate_goal_to_overnight_trips) by suffix of the variables, None for all trips
+trip_goals_agg_by_suffix = {'': None,
+                            '_private': 1,
+                            '_business': 2,
+                            '_other': 3}
+# Titles of the results (in the CSV-files) by suffix of the variables
+col_titles_by_suffix = {'': 'Average distance made by plane per person in 2015, in km',
+                        '_private': 'Average distance made by plane per person in 2015 (private trips), in km',
+                        '_business': 'Average distance made by plane per person in 2015 (business trips), in km',
+                        '_other': 'Average distance made by plane per person in 2015 (other trips), in km'}
+# Age categories (including names for CSV-files)
+age_bins = [5, 17, 24, 44, 64, 79, 100]
+age_labels = ['6-17 years', '18-24 years', '25-44 years', '45-64 years', '65-79 years', '80 years and over']
+
+
+def run_distance_by_plane_in_switzerland_in_2015(variance_method=None, nb_of_replicates=1000, chunksize=None,
+                                                 outputs=('csv',), figures=True, path_2_input=None,
+                                                 path_2_output=None, path_2_store=None,
+                                                 max_size_of_store_in_bytes=default_max_size_in_bytes):
+    # variance_method: None (design effect), 'bootstrap' or 'jackknife' (see utils_mtmc/replicate_weights.py)
+    # chunksize: if defined, trips with overnights are read and aggregated by chunks of chunksize trips
+    # outputs: formats of the files with the results, 'csv' (one file by category of trips), 'json' and/or 'cube'
+    # (weighted sums by age in years, to compute results for other age categories, see utils_mtmc/weighted_cube.py).
+    # The cube contains data of single persons and is saved with the cache of the input files, not in path_2_output.
+    # path_2_store: if defined, the results of the stages (see get_stages) are kept in this folder and a new run only
+    # recomputes the stages whose data, parameters or code changed (see utils_mtmc/stage_store.py)
+    # If profiling is enabled (see utils_mtmc/stage_profiling.py), a report is saved as profiling_report.json
+    if path_2_output is None:
+        path_2_output = os.path.join('..', 'data', 'output')
+    stages = get_stages(year=2015, variance_method=variance_method, nb_of_replicates=nb_of_replicates,
+                        chunksize=chunksize, outputs=outputs, figures=figures, path_2_input=path_2_input,
+                        path_2_output=path_2_output, path_2_store=path_2_store)
+    output_total, output_by_age, nb_of_obs = get_stage_result(stages['compute weighted averages by group'],
+                                                              path_2_store, max_size_of_store_in_bytes)
     print('Basis total distance:', nb_of_obs,
           'persons who were asked about trips with overnights and with a valid information about the distance')
     # Result: 17054
-    # Sum of weights of the detailed trips, without those missing details, in particular distance
-    weight_detailed_trips = df_zp[df_zp['with_trips']]['WP'].sum()
-    # Correction factor for people declaring they did trips, but without detailing them
-    correction_factor_declared_detailed_trips = weight_declared_trips / weight_detailed_trips
-    # Trips have been asked for 4 months on the phone in the MTMC and must be extrapolated for a year
-    extrapolation_factor_4_months_to_1_year = 365.0 / 120
-    df_zp['WP_corrected'] = np.where(df_zp['with_trips'],
-                                     df_zp['WP'] * correction_factor_declared_detailed_trips,
-                                     df_zp['WP'])
-    df_zp['average_plane_dist'] = np.where(df_zp['with_trips'],
-                                           df_zp['total_distance_extrapolated']
-                                           * extrapolation_factor_4_months_to_1_year,
-                                           0)
-    df_zp['average_plane_dist_private'] = np.where(df_zp['with_trips'],
-                                                   df_zp['total_distance_extrapolated_private']
-                                                   * extrapolation_factor_4_months_to_1_year,
-                                                   0)
-    df_zp['average_plane_dist_business'] = np.where(df_zp['with_trips'],
-                                                    df_zp['total_distance_extrapolated_business']
-                                                    * extrapolation_factor_4_months_to_1_year,
-                                                    0)
-    df_zp['average_plane_dist_other'] = np.where(df_zp['with_trips'],
-                                                 df_zp['total_distance_extrapolated_other']
-                                                 * extrapolation_factor_4_months_to_1_year,
-                                                 0)
-    weighted_avg, weighted_std = get_weighted_average_and_std(df_zp, 'average_plane_dist')
+    weighted_avg = output_total.iloc[0][('average_plane_dist', 'weighted_avg')]
+    weighted_std = output_total.iloc[0][('average_plane_dist', 'weighted_std')]
     print('Average distance made by plane per person in 2015, in km:',
           weighted_avg, ' (+/-', str(weighted_std) + ')')
     # Result: 5924.873511771452
-    # Define age categories (including names for CSV-files)
-    age_bins = pd.cut(df_zp['age'], [5, 17, 24, 44, 64, 79, 100],
-                      labels=['6-17 years', '18-24 years', '25-44 years', '45-64 years', '65-79 years',
-                              '80 years and over'])
-    # # Compute results by age
-    output_by_age_as_series = df_zp.groupby(age_bins).apply(get_weighted_average_and_std, 'average_plane_dist')
-    # Save results as CSV-file
-    save_results_as_csv_file(output_by_age_as_series,
-                             col_title='Average distance made by plane per person in 2015, in km')
-    # Decompose between private, business and other trips and save as CSV, by age category
-    output_by_age_as_df_private, output_by_age_as_df_business, output_by_age_as_df_other = \
-        decompose_distances_by_categories_of_trips(df_zp, age_bins)
-    # Generate a figure with the results
-    generate_figure_by_age_by_trip_category(output_by_age_as_df_private,
-                                            output_by_age_as_df_business,
-                                            output_by_age_as_df_other)
-
-
-def generate_figure_by_age_by_trip_category(output_by_age_as_df_private, output_by_age_as_df_business,
-                                            output_by_age_as_df_other):
-    dict_title = {'fr': "Distance totale$^1$ des voyages en avion par personne\nselon l'âge et le motif, en 2015",
-                  'en': 'Total distance$^1$ of trips by plane per person\nby age and purpose in 2015',
-                  'de': 'Gesamtdistanz$^1$ der Flugreisen pro Person\nnach Alter und Zweck, 2015'}
-    dict_bottom_text = {'fr': '$^1$ Voyages aller et retour et distances sur place.\n\n'
-                              'Base: 17 054 personnes cible interrogées dans le module supplémentaire\n"Voyages avec '
-                              'nuitées", avec indication valable de la distance\n\n'
-                              'Source: OFS, ARE - Microrecensement mobilité et transports (MRMT)',
-                        'en': '$^1$ Outward and return journeys and distances at destination.\n\n'
-                              'Basis: 17 054 persons who were asked about trips with '
-                              'overnight stays and could provide\n'
-                              'valid information about the distance covered\n\n'
-                              'Source: FSO, ARE - Mobility and Transport Microcensus (MTMC)',
-                        'de': '$^1$ Hinreise(n), Rückreise(n) und Distanzen vor Ort.\n\n'
-                              'Basis: 17 054 Zielpersonen die zum Zusatzmodul Reisen mit Übernachtungen befragt '
-                              'wurden,\nmit gültigen Angaben zur Distanz\n\n'
-                              'Quelle: BFS, ARE – Mikrozensus Mobilität und Verkehr (MZMV)'}
-    dict_categories = {'en': ['Private trips', 'Business trips', 'Other'],
-                       'fr': ["Voyages d'ordre privé", "Voyages d'affaires", 'Autres'],
-                       'de': ['Privatreisen', 'Geschäftsreisen', 'übrige']}
-    fso_colors = ['#A1D6EF', '#F07E00', '#CFD0D0']
-    dict_y_ticks = {'en': ['6-17 years', '18-24 years', '25-44 years', '45-64 years', '65-79 years',
-                           '80 years and over'],
-                    'fr': ['6-17 ans', '18-24 ans', '25-44 ans', '45-64 ans', '65-79 ans', '80 ans et plus'],
-                    'de': ['6-17 Jahre', '18-24 Jahre', '25-44 Jahre', '45-64 Jahre', '65-79 Jahre',
-                           '80 Jahre und mehr']}
-    for language in ['fr', 'de', 'en']:
-        df_by_age = pd.concat([output_by_age_as_df_private.iloc[:, 0].rename(dict_categories[language][0]),
-                               output_by_age_as_df_business.iloc[:, 0].rename(dict_categories[language][1]),
-                               output_by_age_as_df_other.iloc[:, 0].rename(dict_categories[language][2])], axis=1)
-
-        df_by_age.plot.barh(stacked=True, color=fso_colors)
-        ax = plt.gca()
-        ax.invert_yaxis()
-        plt.ylabel('')
-        plt.yticks(range(len(dict_y_ticks[language])), dict_y_ticks[language])
-        plt.title(dict_title[language])
-        plt.legend(loc=4, mode='expand', ncol=3, bbox_to_anchor=(0., -0.2, 1., 0.102))
-        ax.xaxis.grid(True)
-        # Add "km" at the end of x-axis
-        ticklabelpad = plt.rcParams['xtick.major.pad']
-        ax.annotate('km', xy=(1, 0), xytext=(5, -2 * ticklabelpad), ha='left', va='top', xycoords='axes fraction',
-                    textcoords='offset points')
-        # Add total km at the end of the bars
-        i = 0
-        for total_km in \
-                df_by_age[dict_categories[language][0]] + \
-                df_by_age[dict_categories[language][1]] + \
-                df_by_age[dict_categories[language][2]]:
-            ax.text(total_km + 100, i + 0.07, str(round(total_km)), fontweight='bold')
-            i += 1
-        # Remove top and right axis
-        ax.spines['right'].set_visible(False)
-        ax.spines['top'].set_visible(False)
-        # Add values in the stack bars
-        labels = []
-        for trip_category in df_by_age.columns:
-            for age_category in df_by_age.index:
-                label = int(round(df_by_age[trip_category][age_category]))
-                labels.append(label)
-        patches = ax.patches
-        for label, rect in zip(labels, patches):
-            width = rect.get_width()
-            if width > 700:
-                x = rect.get_x()
-                y = rect.get_y()
-                height = rect.get_height()
-                ax.text(x+width/2., y+height/2., label, ha='center', va='center')
-        # Add text below the figure
-        if language == 'fr':
-            plt.text(-1850, 8.5, dict_bottom_text[language], ha='left')
-        elif language == 'de':
-            plt.text(-2450, 8.5, dict_bottom_text[language], ha='left')
+    # Decompose between private, business and other trips
+    decompose_distances_by_categories_of_trips(output_total.iloc[0])
+    # Save results, by age category, and generate a figure with the results
+    for name_stage in ['save CSV-files', 'save JSON-file', 'save cube', 'generate figures']:
+        if name_stage in stages:
+            get_stage_result(stages[name_stage], path_2_store, max_size_of_store_in_bytes)
+    if path_2_store is not None:
+        for stage in stages.values():
+            print('Stage "' + stage['name'] + '":', stage['status'] or 'not needed')
+    if is_profiling_enabled():
+        save_profiling_report(os.path.join(path_2_output, 'profiling_report.json'))
+
+
+def get_stages(year=2015, excluded_hhnr=None, age_bins=age_bins, age_labels=age_labels, variance_method=None,
+               nb_of_replicates=1000, chunksize=None, outputs=('csv',), figures=True, path_2_input=None,
+               path_2_output=None, path_2_store=None):
+    # Stages of the computation (see utils_mtmc/stage_store.py): load -> filter -> per-person aggregate -> weight
+    # correction -> group statistics -> files with the results and figures. The source code of the functions run by a
+    # stage (the hash of figure_distance_by_plane.py for the figures), the hashes of the input files, the codes of the
+    # MTMC (see utils_mtmc/get_mtmc_files.py) and the settings of this file used by a stage are in its key, so that a
+    # change only invalidates the stages using it and the stages downstream of them.
+    if path_2_output is None:
+        path_2_output = os.path.join('..', 'data', 'output')
+    mtmc_year = get_mtmc_year(year)
+    if path_2_store is None:
+        # Without store, the keys are not used and the files are not hashed (in streaming mode, the file of the trips
+        # is not in the cache of the input files and would have to be read once more)
+        sha256_of_files = {mtmc_year['zp_file']: None, mtmc_year['overnight_trips_file']: None}
+        sha256_of_figure_file = None
+    else:
+        sha256_of_files = get_sha256_of_mtmc_files(year, path_2_input)
+        path_2_figure_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'figure_distance_by_plane.py')
+        sha256_of_figure_file = get_sha256_of_files([path_2_figure_file])[path_2_figure_file]
+    stages = {}
+    # Input data are read from the cache of the input files (see utils_mtmc/mtmc_cache.py), not from the store
+    stages['load persons'] = \
+        define_stage('load persons', load_persons, {'year': year, 'path_2_input': path_2_input},
+                     key_data={'sha256': sha256_of_files[mtmc_year['zp_file']], 'columns': mtmc_year['zp_columns']},
+                     ignored_in_key=['path_2_input'], persist=False,
+                     called_functions=[get_zp_renamed, get_zp, read_cached_mtmc_file, write_cache])
+    stages['load overnight trips'] = \
+        define_stage('load overnight trips', load_overnight_trips,
+                     {'year': year, 'path_2_input': path_2_input, 'chunksize': chunksize},
+                     key_data={'sha256': sha256_of_files[mtmc_year['overnight_trips_file']],
+                               'columns': mtmc_year['overnight_trips_columns']},
+                     ignored_in_key=['path_2_input', 'chunksize'], persist=False,
+                     called_functions=[get_overnight_trips_renamed, get_overnight_trips, read_cached_mtmc_file,
+                                       read_cached_mtmc_file_in_chunks, replace_missing_values, write_cache])
+    stages['filter persons'] = define_stage('filter persons', filter_persons, {'year': year},
+                                            [stages['load persons']],
+                                            key_data=mtmc_year['codes']['module_overnight_trips'])
+    stages['aggregate trips by person'] = \
+        define_stage('aggregate trips by person', aggregate_trips_by_person,
+                     {'year': year, 'excluded_hhnr': excluded_hhnr},
+                     [stages['filter persons'], stages['load overnight trips']],
+                     key_data={'codes': mtmc_year['codes'], 'trip_goals_agg_by_suffix': trip_goals_agg_by_suffix},
+                     called_functions=[prepare_overnight_trips, add_aggregate_goal_to_overnight_trips,
+                                       add_distances_by_plane, get_sums_by_person_and_category, get_codes_and_values])
+    stages['correct weights'] = define_stage('correct weights', correct_weights, {},
+                                             [stages['aggregate trips by person'], stages['filter persons']])
+    stages['compute weighted averages by group'] = \
+        define_stage('compute weighted averages by group', get_weighted_averages_by_age,
+                     {'age_bins': age_bins, 'age_labels': age_labels, 'variance_method': variance_method,
+                      'nb_of_replicates': nb_of_replicates},
+                     [stages['correct weights'], stages['filter persons']],
+                     key_data=trip_goals_agg_by_suffix,
+                     called_functions=[get_weighted_averages_and_stds_by_group, get_group_codes, get_sums_by_cell,
+                                       get_replicate_weighted_averages_and_stds_in_total_and_by_group,
+                                       get_half_widths, set_replicate_arrays, get_replicate_weighted_sums])
+    # Files are written again if they changed since the last run
+    if 'csv' in outputs:
+        stages['save CSV-files'] = define_stage('save CSV-files', save_results_as_csv_files,
+                                                {'path_2_output': path_2_output},
+                                                [stages['compute weighted averages by group']],
+                                                key_data=col_titles_by_suffix, is_valid_result=are_files_unchanged,
+                                                called_functions=[get_results_as_dfs, get_results_as_df,
+                                                                  save_results_as_csv_file])
+    if 'json' in outputs:
+        stages['save JSON-file'] = define_stage('save JSON-file', save_results_in_json_file,
+                                                {'path_2_output': path_2_output},
+                                                [stages['compute weighted averages by group']],
+                                                is_valid_result=are_files_unchanged,
+                                                called_functions=[save_results_as_json_file])
+    if 'cube' in outputs:
+        stages['save cube'] = define_stage('save cube', save_cube_of_distances_by_plane,
+                                           {'path_2_input': path_2_input}, [stages['correct weights']],
+                                           key_data=trip_goals_agg_by_suffix, is_valid_result=are_files_unchanged,
+                                           called_functions=[get_cube_of_distances_by_plane, get_weighted_cube,
+                                                             save_weighted_cube])
+    if figures:
+        # matplotlib is only imported when figures are generated
+        from figure_distance_by_plane import default_languages, get_figure_description
+        stages['generate figures'] = \
+            define_stage('generate figures', generate_figures, {'path_2_output': path_2_output},
+                         [stages['compute weighted averages by group']],
+                         key_data={'descriptions': {language: get_figure_description(language)
+                                                    for language in default_languages},
+                                   'sha256_of_figure_file': sha256_of_figure_file},
+                         is_valid_result=are_files_unchanged,
+                         called_functions=[get_results_as_dfs, get_results_as_df])
+    return stages
+
+
+def get_input_data(year, path_2_input=None, chunksize=None):
+    df_zp = load_persons(year, path_2_input)
+    # contains all trips with overnights (as an iterator over chunks of trips if chunksize is defined, in which case
+    # trips are only read in the stage 'aggregate trips by person')
+    df_overnight_trips = load_overnight_trips(year, path_2_input, chunksize)
+    return df_zp, df_overnight_trips
+
+
+def load_persons(year, path_2_input=None):
+    with profile_stage('load persons') as stage:
+        df_zp = get_zp_renamed(year, path_2_input)
+        stage['rows_out'] = len(df_zp)
+    return df_zp
+
+
+def load_overnight_trips(year, path_2_input=None, chunksize=None):
+    with profile_stage('load overnight trips') as stage:
+        df_overnight_trips = get_overnight_trips_renamed(year, path_2_input, chunksize)
+        if chunksize is None:
+            stage['rows_out'] = len(df_overnight_trips)
+    return df_overnight_trips
+
+
+def compute_distance_by_plane(df_zp, df_overnight_trips, year, excluded_hhnr=None, age_bins=age_bins,
+                              age_labels=age_labels, variance_method=None, nb_of_replicates=1000):
+    # Returns the results for all persons and by age (see weighted_statistics.py) and the number of observations.
+    # The input DataFrames are not modified, so that they can be used for several computations.
+    # df_overnight_trips can also be an iterator over chunks of trips (streaming mode).
+    df_zp, df_zp_declared = get_persons_with_distances_by_plane(df_zp, df_overnight_trips, year, excluded_hhnr)
+    return get_weighted_averages_by_age(df_zp, df_zp_declared, age_bins, age_labels, variance_method,
+                                        nb_of_replicates)
+
+
+def get_persons_with_distances_by_plane(df_zp, df_overnight_trips, year, excluded_hhnr=None):
+    # Returns the persons used for the estimation, with their average distances by plane (average_plane_dist*) and
+    # their corrected weight (WP_corrected), and all persons declaring their number of trips (see
+    # utils_mtmc/replicate_weights.py)
+    df_zp_declared = filter_persons(df_zp, year)
+    df_zp = aggregate_trips_by_person(df_zp_declared, df_overnight_trips, year, excluded_hhnr)
+    df_zp = correct_weights(df_zp, df_zp_declared)
+    return df_zp, df_zp_declared
+
+
+def filter_persons(df_zp, year):
+    codes = get_mtmc_year(year)['codes']
+    with profile_stage('filter persons', rows_in=len(df_zp)) as stage:
+        # select only people who were asked questions about trips with overnights (module 1b)
+        df_zp = df_zp[df_zp['module_attributed_to_the_respondent'] == codes['module_overnight_trips']]
+        df_zp = df_zp.drop(columns=['module_attributed_to_the_respondent'])
+        # select only people who said the number of trips with overnights they made
+        df_zp['with_trips'] = df_zp['nb_trips_with_overnights'] > 0
+        df_zp = df_zp[~df_zp['nb_trips_with_overnights'] < 0]
+        stage['rows_out'] = len(df_zp)
+    return df_zp
+
+
+def aggregate_trips_by_person(df_zp, df_overnight_trips, year, excluded_hhnr=None):
+    codes = get_mtmc_year(year)['codes']
+    if excluded_hhnr is None:
+        excluded_hhnr = codes['excluded_hhnr']
+    with profile_stage('aggregate trips by person', rows_in=len(df_zp)) as stage:
+        # select overnight trips whose distance is known and add info about aggregated goals
+        if isinstance(df_overnight_trips, pd.DataFrame):
+            df_overnight_trips = prepare_overnight_trips(df_overnight_trips, year)
+        else:
+            df_overnight_trips = (prepare_overnight_trips(df_overnight_trips_chunk, year)
+                                  for df_overnight_trips_chunk in df_overnight_trips)
+        # get number of detailed trips (with distance) and average distance by plane by person and aggregated goal
+        df_zp = add_distances_by_plane(df_zp, df_overnight_trips, codes['plane'])
+        # Remove people who said they did a trip, but whose distance are not valid
+        df_zp = df_zp[~df_zp['HHNR'].isin(excluded_hhnr)]
+        stage['rows_out'] = len(df_zp)
+    return df_zp
+
+
+def correct_weights(df_zp, df_zp_declared):
+    with profile_stage('correct weights', rows_in=len(df_zp)):
+        # Sum of weights of the declared trips, including those without details, in particular distance
+        weight_declared_trips = df_zp_declared[df_zp_declared['with_trips']]['WP'].sum()
+        # Sum of weights of the detailed trips, without those missing details, in particular distance
+        weight_detailed_trips = df_zp[df_zp['with_trips']]['WP'].sum()
+        # Correction factor for people declaring they did trips, but without detailing them
+        correction_factor_declared_detailed_trips = weight_declared_trips / weight_detailed_trips
+        df_zp['WP_corrected'] = np.where(df_zp['with_trips'],
+                                         df_zp['WP'] * correction_factor_declared_detailed_trips,
+                                         df_zp['WP'])
+    return df_zp
+
+
+def get_weighted_averages_by_age(df_zp, df_zp_declared, age_bins=age_bins, age_labels=age_labels,
+                                 variance_method=None, nb_of_replicates=1000):
+    nb_of_obs = len(df_zp)
+    with profile_stage('compute weighted averages by group', rows_in=nb_of_obs) as stage:
+        # Compute results for all persons and by age, for all trips and by aggregated goal
+        name_variables = ['average_plane_dist' + suffix for suffix in trip_goals_agg_by_suffix]
+        age_categories = pd.cut(df_zp['age'], age_bins, labels=age_labels)
+        if variance_method is None:
+            output_total = get_weighted_averages_and_stds_by_group(df_zp, None, name_variables)
+            output_by_age = get_weighted_averages_and_stds_by_group(df_zp, age_categories, name_variables)
+        else:
+            # The replicates are drawn once, for the results for all persons and by age
+            output_total, output_by_age = \
+                get_replicate_weighted_averages_and_stds_in_total_and_by_group(df_zp, df_zp_declared, age_categories,
+                                                                               name_variables,
+                                                                               method=variance_method,
+                                                                               nb_of_replicates=nb_of_replicates)
+        stage['rows_out'] = len(output_total) + len(output_by_age)
+    return output_total, output_by_age, nb_of_obs
+
+
+def get_cube_of_distances_by_plane(df_zp, dimensions=('age',)):
+    # Cube of the weighted sums of the average distances by plane (for all trips and by aggregated goal) by age in
+    # years, to compute results for any age categories with query_weighted_cube (see utils_mtmc/weighted_cube.py)
+    name_variables = ['average_plane_dist' + suffix for suffix in trip_goals_agg_by_suffix]
+    return get_weighted_cube(df_zp, list(dimensions), name_variables)
+
+
+def prepare_overnight_trips(df_overnight_trips, year):
+    df_overnight_trips = df_overnight_trips[df_overnight_trips['trip_distance'] >= 0]  # only trips with valid distance
+    df_overnight_trips = add_aggregate_goal_to_overnight_trips(df_overnight_trips, year)
+    return df_overnight_trips
+
+
+def add_distances_by_plane(df_zp, df_overnight_trips, plane=17):
+    # Sum of the distances by plane (main transport mode 17 in 2015) by person and by aggregated goal, in one pass
+    nb_detailed_trips, distances_by_plane = \
+        get_sums_by_person_and_category(df_zp['HHNR'], df_overnight_trips, 'trip_distance',
+                                        {'main_transport_mode': [plane], 'trip_goal_agg': [1, 2, 3]})
+    distances_by_plane = distances_by_plane[:, 0, :]
+    # Remove people who said they did trips, but without any detailed trip.
+    # People without trips come first, then people with trips (same order as in previous versions of the code).
+    with_trips = df_zp['with_trips'].to_numpy()
+    selected_persons = (~with_trips | (nb_detailed_trips > 0)).nonzero()[0]
+    selected_persons = selected_persons[np.argsort(with_trips[selected_persons], kind='stable')]
+    df_zp = df_zp.iloc[selected_persons].copy()
+    nb_detailed_trips = nb_detailed_trips[selected_persons]
+    distances_by_plane = distances_by_plane[selected_persons]
+    with_trips = with_trips[selected_persons]
+    nb_trips_with_overnights = df_zp['nb_trips_with_overnights'].to_numpy()
+    # Trips have been asked for 4 months on the phone in the MTMC and must be extrapolated for a year
+    extrapolation_factor_4_months_to_1_year = 365.0 / 120
+    df_zp['nb_detailed_trips'] = nb_detailed_trips
+    for suffix, trip_goal_agg in trip_goals_agg_by_suffix.items():
+        if trip_goal_agg is None:
+            total_distance = distances_by_plane.sum(axis=1)
         else:
-            plt.text(-2300, 8.5, dict_bottom_text[language], ha='left')
-        plt.savefig(os.path.join('..', 'data', 'output', 'distance_by_plane_by_age_' + language + '.png'),
-                    bbox_inches='tight')
+            total_distance = distances_by_plane[:, trip_goal_agg - 1]
+        # extrapolation for all trips based on declared trips
+        total_distance_extrapolated = np.divide(total_distance * nb_trips_with_overnights, nb_detailed_trips,
+                                                out=np.zeros(len(df_zp)), where=with_trips)
+        df_zp['average_plane_dist' + suffix] = total_distance_extrapolated * extrapolation_factor_4_months_to_1_year
+    return df_zp
 
 
-def decompose_distances_by_categories_of_trips(df_zp, age_bins):
+def decompose_distances_by_categories_of_trips(output_total):
     print('--- Among which ---')
     ''' Private trips '''
-    weighted_avg_private, weighted_std_private = get_weighted_average_and_std(df_zp, 'average_plane_dist_private')
-    print('Only private trips:', weighted_avg_private, '(+/-', str(weighted_std_private) + ')')
-    # Compute results by age
-    output_by_age_as_series_private = df_zp.groupby(age_bins).apply(get_weighted_average_and_std,
-                                                                    'average_plane_dist_private')
-    output_by_age_as_df_private = save_results_as_csv_file(output_by_age_as_series_private,
-                                                           col_title='Average distance made by plane per person in '
-                                                                     '2015 (private trips), in km',
-                                                           extra_path_name='_private')
+    print('Only private trips:', output_total[('average_plane_dist_private', 'weighted_avg')],
+          '(+/-', str(output_total[('average_plane_dist_private', 'weighted_std')]) + ')')
     ''' Business trips '''
-    weighted_avg_business, weighted_std_business = get_weighted_average_and_std(df_zp, 'average_plane_dist_business')
-    print('Only business trips:', weighted_avg_business, '(+/-', str(weighted_std_business) + ')')
-    output_by_age_as_series_business = df_zp.groupby(age_bins).apply(get_weighted_average_and_std,
-                                                                     'average_plane_dist_business')
-    output_by_age_as_df_business = save_results_as_csv_file(output_by_age_as_series_business,
-                                                            col_title='Average distance made by plane per person in '
-                                                                      '2015 (business trips), in km',
-                                                            extra_path_name='_business')
+    print('Only business trips:', output_total[('average_plane_dist_business', 'weighted_avg')],
+          '(+/-', str(output_total[('average_plane_dist_business', 'weighted_std')]) + ')')
     ''' Other trips '''
-    weighted_avg_other, weighted_std_other = get_weighted_average_and_std(df_zp, 'average_plane_dist_other')
-    print('Only other trips:', weighted_avg_other, '(+/-', str(weighted_std_other) + ')')
-    output_by_age_as_series_other = df_zp.groupby(age_bins).apply(get_weighted_average_and_std,
-                                                                  'average_plane_dist_other')
-    output_by_age_as_df_other = save_results_as_csv_file(output_by_age_as_series_other,
-                                                         col_title='Average distance made by plane per person in 2015 '
-                                                                   '(other trips), in km',
-                                                         extra_path_name='_other')
-    return output_by_age_as_df_private, output_by_age_as_df_business, output_by_age_as_df_other
-
-
-def save_results_as_csv_file(output_by_age_as_series, col_title, extra_path_name=''):
-    output_by_age_as_df = pd.DataFrame(output_by_age_as_series.tolist(),
-                                       columns=[col_title, '+/-'],
-                                       index=output_by_age_as_series.index)
+    print('Only other trips:', output_total[('average_plane_dist_other', 'weighted_avg')],
+          '(+/-', str(output_total[('average_plane_dist_other', 'weighted_std')]) + ')')
+
+
+def get_results_as_df(output_by_age, col_title):
+    # output_by_age contains the columns 'weighted_avg' and 'weighted_std' (see weighted_statistics.py)
+    output_by_age_as_df = pd.DataFrame({col_title: output_by_age['weighted_avg'],
+                                        '+/-': output_by_age['weighted_std']},
+                                       index=output_by_age.index)
     output_by_age_as_df.index.names = ['Age category']
-    output_by_age_as_df.to_csv(os.path.join('..', 'data', 'output',
-                                            'distance_by_plane_by_age' + extra_path_name + '.csv'))
     return output_by_age_as_df
 
 
-def get_weighted_average_and_std(df_zp, name_variable):
-    nb_of_obs = len(df_zp['HHNR'].unique())
-    weighted_avg = (df_zp[name_variable] * df_zp['WP_corrected']).sum() / df_zp['WP_corrected'].sum()
-    variance = np.divide((df_zp['WP_corrected'] * ((df_zp[name_variable] - weighted_avg) ** 2)).sum(),
-                         df_zp['WP_corrected'].sum() - 1)
-    weighted_std = np.divide(1.645 * 1.14 * np.sqrt(variance), np.sqrt(nb_of_obs))
-    return weighted_avg, weighted_std
+def get_results_as_dfs(output_by_age):
+    # One DataFrame by category of trips, by suffix of the variables
+    return {suffix: get_results_as_df(output_by_age['average_plane_dist' + suffix],
+                                      col_title=col_titles_by_suffix[suffix])
+            for suffix in trip_goals_agg_by_suffix}
+
+
+def save_results_as_csv_files(results, path_2_output=None):
+    # results: output_total, output_by_age and nb_of_obs (see compute_distance_by_plane)
+    # Returns the hashes of the files (see utils_mtmc/stage_store.py)
+    _, output_by_age, _ = results
+    with profile_stage('save CSV-files'):
+        paths_2_files = [save_results_as_csv_file(output_by_age_as_df, extra_path_name=suffix,
+                                                  path_2_output=path_2_output)
+                         for suffix, output_by_age_as_df in get_results_as_dfs(output_by_age).items()]
+    return get_sha256_of_files(paths_2_files)
+
+
+def save_results_as_csv_file(output_by_age_as_df, extra_path_name='', path_2_output=None):
+    if path_2_output is None:
+        path_2_output = os.path.join('..', 'data', 'output')
+    path_2_file = os.path.join(path_2_output, 'distance_by_plane_by_age' + extra_path_name + '.csv')
+    output_by_age_as_df.to_csv(path_2_file)
+    return path_2_file
+
+
+def save_results_in_json_file(results, path_2_output=None):
+    with profile_stage('save JSON-file'):
+        path_2_file = save_results_as_json_file(*results, path_2_output=path_2_output)
+    return get_sha256_of_files([path_2_file])
+
 
+def save_results_as_json_file(output_total, output_by_age, nb_of_obs, path_2_output=None):
+    # All results in a single file: {variable: {'Total' or age category: {'weighted_avg': ..., 'weighted_std': ...}}}
+    if path_2_output is None:
+        path_2_output = os.path.join('..', 'data', 'output')
+    output_total = output_total.set_axis(['Total'])
+    results = {'nb_of_obs': int(nb_of_obs)}
+    for name_variable in output_by_age.columns.unique(level=0):
+        output = pd.concat([output_total[name_variable], output_by_age[name_variable]])
+        results[name_variable] = {str(category): {'weighted_avg': float(row['weighted_avg']),
+                                                  'weighted_std': float(row['weighted_std'])}
+                                  for category, row in output.iterrows()}
+    path_2_file = os.path.join(path_2_output, 'distance_by_plane_by_age.json')
+    with open(path_2_file, 'w') as json_file:
+        json.dump(results, json_file, indent=4)
+    return path_2_file
 
-def get_zp_renamed():
-    selected_columns = ['HHNR', 'WP', 'dmod', 'f70100', 'alter']
-    df_zp = get_zp(year=2015, selected_columns=selected_columns)
+
+def save_cube_of_distances_by_plane(df_zp, path_2_input=None):
+    # Cells of the cube can contain a single person (e.g., at high ages): the cube contains personal data and is saved
+    # in the cache of the input files (data/input/cache), which must not be shared either
+    if path_2_input is None:
+        path_2_input = default_path_2_input
+    os.makedirs(os.path.join(path_2_input, cache_folder_name), exist_ok=True)
+    path_2_file = os.path.join(path_2_input, cache_folder_name, 'distance_by_plane_cube.npz')
+    with profile_stage('save cube', rows_in=len(df_zp)):
+        save_weighted_cube(get_cube_of_distances_by_plane(df_zp), path_2_file)
+    return get_sha256_of_files([path_2_file])
+
+
+def generate_figures(results, path_2_output=None):
+    if path_2_output is None:
+        path_2_output = os.path.join('..', 'data', 'output')
+    _, output_by_age, _ = results
+    outputs_by_age_as_df = get_results_as_dfs(output_by_age)
+    with profile_stage('generate figures'):
+        # matplotlib is only imported when figures are generated
+        from figure_distance_by_plane import default_languages, generate_figure_by_age_by_trip_category
+        generate_figure_by_age_by_trip_category(outputs_by_age_as_df['_private'],
+                                                outputs_by_age_as_df['_business'],
+                                                outputs_by_age_as_df['_other'],
+                                                path_2_output=path_2_output)
+    return get_sha256_of_files([os.path.join(path_2_output, 'distance_by_plane_by_age_' + language + '.png')
+                                for language in default_languages])
+
+
+def get_zp_renamed(year=2015, path_2_input=None):
+    zp_columns = get_mtmc_year(year)['zp_columns']
+    df_zp = get_zp(year=year, selected_columns=list(zp_columns), path_2_input=path_2_input)
     # Rename variables
-    df_zp = df_zp.rename(columns={'dmod': 'module_attributed_to_the_respondent',
-                                  'f70100': 'nb_trips_with_overnights',
-                                  'alter': 'age'})
+    df_zp = df_zp.rename(columns=zp_columns)
     return df_zp
 
 
-def get_overnight_trips_in_2015_renamed():
-    selected_columns = ['HHNR', 'WP', 'RENR', 'reisenr', 'f70801', 'f71300', 'f71400_01', 'f71600b',
-                        'f70700_01', 'f71700b']
-    df_overnight_trips = get_overnight_trips(year=2015, selected_columns=selected_columns)
+def get_overnight_trips_renamed(year=2015, path_2_input=None, chunksize=None):
+    overnight_trips_columns = get_mtmc_year(year)['overnight_trips_columns']
+    df_overnight_trips = get_overnight_trips(year=year, selected_columns=list(overnight_trips_columns),
+                                             path_2_input=path_2_input, chunksize=chunksize)
     # Rename variables
-    df_overnight_trips = df_overnight_trips.rename(columns={'f71600b': 'trip_distance',
-                                                            'f71700b': 'trip_distance_in_CH',
-                                                            'f70700_01': 'trip_goal',
-                                                            'f70801': 'main_transport_mode'})
+    if chunksize is not None:
+        return (df_overnight_trips_chunk.rename(columns=overnight_trips_columns)
+                for df_overnight_trips_chunk in df_overnight_trips)
+    df_overnight_trips = df_overnight_trips.rename(columns=overnight_trips_columns)
     return df_overnight_trips
 
 
-def add_aggregate_goal_to_overnight_trips(df_overnight_trips):
-    conditions_trip_goal = [df_overnight_trips['trip_goal'].isin([2,  # private: shopping
-                                                                  3,  # Private: medical
-                                                                  5,  # private: visit friends and family
-                                                                  6,  # Private: gastronomie
-                                                                  7,  # Private: active sport
-                                                                  8,  # Private: hiking
-                                                                  9,  # Private: bike tour
-                                                                  10,  # Private: passive sport
-                                                                  11,  # Private: outdoor activities (no sport)
-                                                                  12,  # Private: Culture and leisure
-                                                                  13,  # Private: Holidays, trips
-                                                                  14,  # Private: Religion
-                                                                  16,  # Private: Accompany for private trips
-                                                                  17,  # Private: Round trip
-                                                                  ]),
-                            df_overnight_trips['trip_goal'].isin([4,  # Work: business trip
-                                                                  15,  # Work: Accompany for work trips
-                                                                  ])]
+def add_aggregate_goal_to_overnight_trips(df_overnight_trips, year=2015):
+    codes = get_mtmc_year(year)['codes']
+    conditions_trip_goal = [df_overnight_trips['trip_goal'].isin(codes['private_trip_goals']),
+                            df_overnight_trips['trip_goal'].isin(codes['business_trip_goals'])]
     choices_trip_goal = [1, 2]  # private (1), business (2), other (3, as default)
     df_overnight_trips['trip_goal_agg'] = np.select(conditions_trip_goal, choices_trip_goal, default=3)
     return df_overnight_trips
 
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Average distance made by plane per person in Switzerland in 2015')
+    parser.add_argument('--no-figures', action='store_true',
+                        help='do not generate the figures (matplotlib is then not imported)')
+    parser.add_argument('--outputs', nargs='+', choices=['csv', 'json', 'cube'], default=['csv'],
+                        help='formats of the files with the results (default: csv)')
+    parser.add_argument('--input-dir', default=None, help='folder of the input files (default: ../data/input)')
+    parser.add_argument('--output-dir', default=None, help='folder of the results (default: ../data/output)')
+    parser.add_argument('--variance-method', choices=['bootstrap', 'jackknife'], default=None,
+                        help='compute the confidence intervals with replicate weights instead of the design effect')
+    parser.add_argument('--nb-of-replicates', type=int, default=1000, help='number of replicates (default: 1000)')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='read and aggregate the trips by chunks of this number of trips')
+    parser.add_argument('--profile', action='store_true',
+                        help='save the time and memory used by each stage in profiling_report.json '
+                             '(also activated by the environment variable MTMC_PROFILE=1)')
+    parser.add_argument('--profile-cprofile', default=None,
+                        help='with --profile, also save a cProfile file for each stage in this folder')
+    parser.add_argument('--stage-store', nargs='?', const=default_path_2_store, default=None,
+                        help='keep the results of the stages in this folder (default: '
+                             '../data/input/cache/stage_store), so that a new run only recomputes the stages whose '
+                             'data, parameters or code changed. '
+                             'The results contain personal data: DO NOT commit or share this folder')
+    parser.add_argument('--stage-store-max-size', type=int, default=default_max_size_in_bytes // 1024 ** 2,
+                        help='maximal size of the stage store in MB, the least recently used results are removed '
+                             '(default: ' + str(default_max_size_in_bytes // 1024 ** 2) + ')')
+    args = parser.parse_args(argv)
+    if args.nb_of_replicates < 2:
+        parser.error('the number of replicates must be at least 2')
+    if args.profile:
+        enable_profiling(args.profile_cprofile)
+    run_distance_by_plane_in_switzerland_in_2015(variance_method=args.variance_method,
+                                                 nb_of_replicates=args.nb_of_replicates,
+                                                 chunksize=args.chunksize,
+                                                 outputs=args.outputs,
+                                                 figures=not args.no_figures,
+                                                 path_2_input=args.input_dir,
+                                                 path_2_output=args.output_dir,
+                                                 path_2_store=args.stage_store,
+                                                 max_size_of_store_in_bytes=args.stage_store_max_size * 1024 ** 2)
+
+
 if __name__ == '__main__':
-    run_distance_by_plane_in_switzerland_in_2015()
+    main()
@@ -0,0 +1,188 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+from utils_mtmc.stage_store import get_stage_result, default_path_2_store
+from utils_mtmc.weighted_cube import query_weighted_cube
+from run_distance_by_plane_in_switzerland_in_2015 import get_stages, get_cube_of_distances_by_plane, \
+    get_results_as_dfs, age_bins, age_labels
+
+# Local service answering questions about the distances by plane, without reading and preparing the data again for
+# each question. At start, the persons with their distances by plane and corrected weights are taken from the stage
+# store (see utils_mtmc/stage_store.py) or, the first time, computed from the input files and saved in the store for
+# the next start. They are kept in memory as a cube of weighted sums by age in years (see utils_mtmc/weighted_cube.py).
+# Requests are HTTP GET on localhost, answers are in JSON:
+# /average?age_min=25&age_max=44&purpose=business: average distance by plane per person for the ages from age_min to
+#     age_max (included, default: all ages) and the purpose of the trips (all, private, business or other)
+# /by_age?age_bins=5,24,64,100&purpose=all: results by age category (bin edges as in pd.cut, default: the age
+#     categories of the CSV-files)
+# /figure?language=de: draws the figure in this language (fr, de or en) in a worker process and saves it in the
+#     output folder
+# /status: number of persons and time taken to load the data
+suffix_by_purpose = {'all': '',
+                     'private': '_private',
+                     'business': '_business',
+                     'other': '_other'}
+http_reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                500: 'Internal Server Error'}
+service = {}  # Data of the service, kept in memory
+
+
+def load_service_data(path_2_input=None, path_2_output=None, path_2_store=default_path_2_store):
+    if path_2_output is None:
+        path_2_output = os.path.join('..', 'data', 'output')
+    start = time.perf_counter()
+    stages = get_stages(year=2015, outputs=(), figures=False, path_2_input=path_2_input, path_2_output=path_2_output,
+                        path_2_store=path_2_store)
+    df_zp = get_stage_result(stages['correct weights'], path_2_store)
+    results = get_stage_result(stages['compute weighted averages by group'], path_2_store)
+    return {'cube': get_cube_of_distances_by_plane(df_zp),
+            'results': results,
+            'path_2_output': path_2_output,
+            'loading_time_in_s': time.perf_counter() - start,
+            'loaded_from_store': stages['correct weights']['status'] == 'loaded',
+            'figures_in_progress': {}}
+
+
+async def handle_connection(reader, writer):
+    try:
+        request_line = (await reader.readline()).decode('latin1')
+        # Headers are not used
+        while (await reader.readline()) not in [b'\r\n', b'\n', b'']:
+            pass
+        status, answer = await answer_request(request_line)
+    except ValueError as error:
+        status, answer = 400, {'error': str(error)}
+    except Exception as error:
+        status, answer = 500, {'error': str(error)}
+    body = json.dumps(answer, indent=4).encode('utf-8')
+    writer.write(('HTTP/1.1 ' + str(status) + ' ' + http_reasons[status] + '\r\n'
+                  'Content-Type: application/json\r\n'
+                  'Content-Length: ' + str(len(body)) + '\r\n'
+                  'Connection: close\r\n\r\n').encode('latin1') + body)
+    await writer.drain()
+    writer.close()
+
+
+async def answer_request(request_line):
+    parts = request_line.split()
+    if len(parts) != 3:
+        raise ValueError('Request not well defined')
+    method, target, _ = parts
+    if method != 'GET':
+        return 405, {'error': 'Only GET requests are accepted'}
+    url = urlsplit(target)
+    parameters = {name_parameter: values[-1] for name_parameter, values in parse_qs(url.query).items()}
+    # Queries of the cube take a few milliseconds and are answered directly, figures are drawn in a worker process
+    if url.path == '/average':
+        return 200, get_average(parameters)
+    elif url.path == '/by_age':
+        return 200, get_results_by_age(parameters)
+    elif url.path == '/figure':
+        return 200, await generate_figure(parameters)
+    elif url.path == '/status':
+        return 200, {'nb_of_obs': int(service['results'][2]),
+                     'loading_time_in_s': service['loading_time_in_s'],
+                     'loaded_from_store': service['loaded_from_store']}
+    return 404, {'error': 'Unknown path: ' + url.path}
+
+
+def get_average(parameters):
+    name_variable = get_name_variable(parameters)
+    ages = service['cube']['levels'][0]
+    age_min = int(parameters.get('age_min', ages.min()))
+    age_max = int(parameters.get('age_max', ages.max()))
+    output = query_weighted_cube(service['cube'], filters={'age': ages[(ages >= age_min) & (ages <= age_max)]},
+                                 name_variables=[name_variable])
+    if output.empty:
+        raise ValueError('No person between ' + str(age_min) + ' and ' + str(age_max) + ' years')
+    return {'age_min': age_min,
+            'age_max': age_max,
+            'purpose': parameters.get('purpose', 'all'),
+            'weighted_avg': float(output.iloc[0][(name_variable, 'weighted_avg')]),
+            'weighted_std': float(output.iloc[0][(name_variable, 'weighted_std')])}
+
+
+def get_results_by_age(parameters):
+    name_variable = get_name_variable(parameters)
+    if 'age_bins' in parameters:
+        bins = [int(age) for age in parameters['age_bins'].split(',')]
+        labels = None
+    else:
+        bins = age_bins
+        labels = age_labels
+    output = query_weighted_cube(service['cube'], by=['age'], bins={'age': bins}, labels={'age': labels},
+                                 name_variables=[name_variable])
+    return {'purpose': parameters.get('purpose', 'all'),
+            'results': [{'age_category': str(age_category),
+                         'weighted_avg': float(row[(name_variable, 'weighted_avg')]),
+                         'weighted_std': float(row[(name_variable, 'weighted_std')])}
+                        for age_category, row in output.iterrows()]}
+
+
+def get_name_variable(parameters):
+    purpose = parameters.get('purpose', 'all')
+    if purpose not in suffix_by_purpose:
+        raise ValueError('Purpose not well defined, must be one of: ' + ', '.join(suffix_by_purpose))
+    return 'average_plane_dist' + suffix_by_purpose[purpose]
+
+
+async def generate_figure(parameters):
+    language = parameters.get('language', 'fr')
+    if language not in ['fr', 'de', 'en']:
+        raise ValueError('Language not well defined, must be one of: fr, de, en')
+    # Requests for a figure being drawn wait for the same drawing
+    if language not in service['figures_in_progress']:
+        future = asyncio.get_running_loop().run_in_executor(service['executor'], generate_figure_in_language,
+                                                            service['results'], language, service['path_2_output'])
+        future.add_done_callback(lambda _: service['figures_in_progress'].pop(language, None))
+        service['figures_in_progress'][language] = future
+    path_2_figure = await service['figures_in_progress'][language]
+    return {'language': language, 'figure': os.path.abspath(path_2_figure)}
+
+
+def generate_figure_in_language(results, language, path_2_output):
+    # Runs in a worker process. matplotlib is only imported there.
+    from figure_distance_by_plane import generate_figure_by_age_by_trip_category
+    outputs_by_age_as_df = get_results_as_dfs(results[1])
+    generate_figure_by_age_by_trip_category(outputs_by_age_as_df['_private'],
+                                            outputs_by_age_as_df['_business'],
+                                            outputs_by_age_as_df['_other'],
+                                            languages=(language,), path_2_output=path_2_output, max_workers=1)
+    return os.path.join(path_2_output, 'distance_by_plane_by_age_' + language + '.png')
+
+
+async def serve(host, port):
+    server = await asyncio.start_server(handle_connection, host, port)
+    print('Serving on http://' + host + ':' + str(port))
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Local service for the average distance made by plane per person')
+    parser.add_argument('--host', default='127.0.0.1', help='address of the service (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8015, help='port of the service (default: 8015)')
+    parser.add_argument('--input-dir', default=None, help='folder of the input files (default: ../data/input)')
+    parser.add_argument('--output-dir', default=None, help='folder of the figures (default: ../data/output)')
+    parser.add_argument('--stage-store', default=default_path_2_store,
+                        help='folder of the stage store, used for warm starts (default: '
+                             '../data/input/cache/stage_store). It contains personal data: DO NOT commit or share it')
+    parser.add_argument('--max-workers', type=int, default=None, help='number of worker processes')
+    args = parser.parse_args(argv)
+    service.update(load_service_data(args.input_dir, args.output_dir, args.stage_store))
+    print('Data loaded in', round(service['loading_time_in_s'], 3), 's',
+          '(from the stage store)' if service['loaded_from_store'] else '(from the input files)')
+    with ProcessPoolExecutor(max_workers=args.max_workers) as executor:
+        service['executor'] = executor
+        try:
+            asyncio.run(serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == '__main__':
+    main()
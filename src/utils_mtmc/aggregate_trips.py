@@ -0,0 +1,44 @@
+import pandas as pd
+import numpy as np
+
+
+def get_sums_by_person_and_category(person_ids, df_trips, name_variable, categories, id_column='HHNR'):
+    # Sums name_variable by person and by category of trips in a single pass over the trips.
+    # categories is a dictionary {column: list of levels}. The result is a dense matrix with one row per person
+    # (in the order of person_ids) and one axis per column of categories (in the order of the levels).
+    # Trips whose value is not in the levels are not summed, but still counted in the number of trips.
+    # df_trips is either a DataFrame or an iterable of DataFrames (chunks of trips, streaming mode). In the streaming
+    # mode, only the sums by person are kept in memory, and the results are exactly the same.
+    # Returns the number of trips by person and the matrix of sums.
+    person_index = pd.Index(person_ids)
+    nb_of_persons = len(person_ids)
+    shape = tuple(len(levels) for levels in categories.values())
+    nb_of_categories = int(np.prod(shape))
+    if isinstance(df_trips, pd.DataFrame):
+        person_codes, cell_codes, values = get_codes_and_values(person_index, df_trips, name_variable, categories,
+                                                                id_column)
+        sums = np.bincount(cell_codes, weights=values, minlength=nb_of_persons * nb_of_categories)
+        nb_of_trips = np.bincount(person_codes, minlength=nb_of_persons)
+    else:
+        sums = np.zeros(nb_of_persons * nb_of_categories)
+        nb_of_trips = np.zeros(nb_of_persons, dtype=np.int64)
+        for df_trips_chunk in df_trips:
+            person_codes, cell_codes, values = get_codes_and_values(person_index, df_trips_chunk, name_variable,
+                                                                    categories, id_column)
+            # np.add.at adds the values one after the other, in the same order as np.bincount
+            np.add.at(sums, cell_codes, values)
+            np.add.at(nb_of_trips, person_codes, 1)
+    return nb_of_trips, sums.reshape((nb_of_persons,) + shape)
+
+
+def get_codes_and_values(person_index, df_trips, name_variable, categories, id_column):
+    # Returns the position of the person of each trip, the cell (person x category) of the trips in categories and
+    # their value. Trips of persons not in person_index are ignored.
+    shape = tuple(len(levels) for levels in categories.values())
+    person_codes = person_index.get_indexer(df_trips[id_column])
+    category_codes = [pd.Index(levels).get_indexer(df_trips[column]) for column, levels in categories.items()]
+    is_in_categories = np.logical_and.reduce([codes >= 0 for codes in category_codes]) & (person_codes >= 0)
+    cell_codes = person_codes[is_in_categories] * int(np.prod(shape)) + \
+        np.ravel_multi_index([codes[is_in_categories] for codes in category_codes], shape)
+    values = df_trips[name_variable].to_numpy(dtype=float)[is_in_categories]
+    return person_codes[person_codes >= 0], cell_codes, values
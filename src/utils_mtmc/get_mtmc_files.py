@@ -1,36 +1,114 @@
-import pandas as pd
 import os.path
+from utils_mtmc.mtmc_cache import read_cached_mtmc_file, read_cached_mtmc_file_in_chunks, get_sha256_of_mtmc_file
 
+default_path_2_input = os.path.join('..', 'data', 'input')
+# Files, variables and codes of each wave of the MTMC, by year. Variables are renamed to the names used in the code.
+mtmc_years = {}
 
-def get_zp(year, selected_columns=None):
-    if year == 2015:
-        path_2_zielpersonen = os.path.join('..', 'data', 'input', 'zielpersonen.csv')
-        if os.path.isfile(path_2_zielpersonen):
-            with open(path_2_zielpersonen, 'r', encoding='latin1') as zielpersonen_file:
-                if selected_columns is None:
-                    df_zp = pd.read_csv(zielpersonen_file)
-                else:
-                    df_zp = pd.read_csv(zielpersonen_file,
-                                        dtype={'HHNR': int},
-                                        usecols=selected_columns)
-                return df_zp
-        else:
-            raise Exception('File "zielpersonen.csv" not in the folder "data/input". Please copy it there.')
+
+def register_mtmc_year(year, zp_file, overnight_trips_file, zp_columns, overnight_trips_columns, codes):
+    # Other waves of the MTMC (e.g., 2010, 2021) can be added with their own files, variables and codes
+    mtmc_years[year] = {'zp_file': zp_file,
+                        'overnight_trips_file': overnight_trips_file,
+                        'zp_columns': zp_columns,
+                        'overnight_trips_columns': overnight_trips_columns,
+                        'codes': codes}
+
+
+def get_mtmc_year(year):
+    if year in mtmc_years:
+        return mtmc_years[year]
     else:
         raise Exception('Year not well defined')
 
 
-def get_overnight_trips(year, selected_columns=None):
-    if year == 2015:
-        path_2_reisenmueb = os.path.join('..', 'data', 'input', 'reisenmueb.csv')
-        if os.path.isfile(path_2_reisenmueb):
-            with open(path_2_reisenmueb, 'r', encoding='latin1') as trips_with_overnight_file:
-                df_trips_with_overnight = pd.read_csv(trips_with_overnight_file,
-                                                      delimiter=',',
-                                                      usecols=selected_columns,
-                                                      na_values=[-99])
-                return df_trips_with_overnight
-        else:
-            Exception('File "reisenmueb.csv" not in the folder "data/input". Please copy it there.')
+register_mtmc_year(2015,
+                   zp_file='zielpersonen.csv',
+                   overnight_trips_file='reisenmueb.csv',
+                   zp_columns={'HHNR': 'HHNR',
+                               'WP': 'WP',
+                               'dmod': 'module_attributed_to_the_respondent',
+                               'f70100': 'nb_trips_with_overnights',
+                               'alter': 'age'},
+                   overnight_trips_columns={'HHNR': 'HHNR',
+                                            'WP': 'WP',
+                                            'RENR': 'RENR',
+                                            'reisenr': 'reisenr',
+                                            'f70801': 'main_transport_mode',
+                                            'f71300': 'f71300',
+                                            'f71400_01': 'f71400_01',
+                                            'f71600b': 'trip_distance',
+                                            'f70700_01': 'trip_goal',
+                                            'f71700b': 'trip_distance_in_CH'},
+                   codes={'module_overnight_trips': 2,  # module 1b
+                          'plane': 17,
+                          'private_trip_goals': [2,  # private: shopping
+                                                 3,  # Private: medical
+                                                 5,  # private: visit friends and family
+                                                 6,  # Private: gastronomie
+                                                 7,  # Private: active sport
+                                                 8,  # Private: hiking
+                                                 9,  # Private: bike tour
+                                                 10,  # Private: passive sport
+                                                 11,  # Private: outdoor activities (no sport)
+                                                 12,  # Private: Culture and leisure
+                                                 13,  # Private: Holidays, trips
+                                                 14,  # Private: Religion
+                                                 16,  # Private: Accompany for private trips
+                                                 17,  # Private: Round trip
+                                                 ],
+                          'business_trip_goals': [4,  # Work: business trip
+                                                  15,  # Work: Accompany for work trips
+                                                  ],
+                          # People who said they did a trip, but whose distance are not valid
+                          'excluded_hhnr': [333950,  # the distance is known, but not the country of destination
+                                            488907,  # the destination is known but is the same as home
+                                            ]})
+
+
+def get_zp(year, selected_columns=None, path_2_input=None):
+    mtmc_year = get_mtmc_year(year)
+    if path_2_input is None:
+        path_2_input = default_path_2_input
+    path_2_zielpersonen = os.path.join(path_2_input, mtmc_year['zp_file'])
+    if os.path.isfile(path_2_zielpersonen):
+        df_zp = read_cached_mtmc_file(path_2_zielpersonen, selected_columns=selected_columns)
+        return df_zp
     else:
-        raise Exception('Year not well defined')
+        raise Exception('File "' + mtmc_year['zp_file'] + '" not in the folder "' + path_2_input +
+                        '". Please copy it there.')
+
+
+def get_overnight_trips(year, selected_columns=None, path_2_input=None, chunksize=None):
+    # With chunksize, returns an iterator over DataFrames of (at most) chunksize trips
+    mtmc_year = get_mtmc_year(year)
+    if path_2_input is None:
+        path_2_input = default_path_2_input
+    path_2_reisenmueb = os.path.join(path_2_input, mtmc_year['overnight_trips_file'])
+    if os.path.isfile(path_2_reisenmueb):
+        if chunksize is not None:
+            return read_cached_mtmc_file_in_chunks(path_2_reisenmueb,
+                                                   selected_columns=selected_columns,
+                                                   na_values=[-99],
+                                                   chunksize=chunksize)
+        df_trips_with_overnight = read_cached_mtmc_file(path_2_reisenmueb,
+                                                        selected_columns=selected_columns,
+                                                        na_values=[-99])
+        return df_trips_with_overnight
+    else:
+        raise Exception('File "' + mtmc_year['overnight_trips_file'] + '" not in the folder "' + path_2_input +
+                        '". Please copy it there.')
+
+
+def get_sha256_of_mtmc_files(year, path_2_input=None):
+    # Hashes of the content of the input files, e.g., to detect changes in the data (see utils_mtmc/stage_store.py)
+    mtmc_year = get_mtmc_year(year)
+    if path_2_input is None:
+        path_2_input = default_path_2_input
+    sha256_by_file = {}
+    for file_name in [mtmc_year['zp_file'], mtmc_year['overnight_trips_file']]:
+        path_2_file = os.path.join(path_2_input, file_name)
+        if not os.path.isfile(path_2_file):
+            raise Exception('File "' + file_name + '" not in the folder "' + path_2_input + '". Please copy it there.')
+        sha256_by_file[file_name] = get_sha256_of_mtmc_file(path_2_file)
+    return sha256_by_file
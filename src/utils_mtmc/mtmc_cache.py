@@ -0,0 +1,143 @@
+import pandas as pd
+import numpy as np
+import hashlib
+import json
+import os
+
+
+# The MTMC files are converted once into one .npy file per column, stored in data/input/cache/<file name>/.
+# Later reads only load the requested columns, memory-mapped (i.e., without copy) for numeric columns.
+# The cache is keyed on the size, the modification time and the SHA-256 hash of the source file.
+cache_folder_name = 'cache'
+manifest_file_name = 'manifest.json'
+
+
+def read_cached_mtmc_file(path_2_file, selected_columns=None, na_values=None):
+    cache_folder = get_cache_folder(path_2_file)
+    manifest = get_valid_manifest(path_2_file, cache_folder)
+    if manifest is None:
+        manifest = write_cache(path_2_file, cache_folder)
+    if selected_columns is None:
+        columns = manifest['columns']
+    else:
+        missing_columns = [column for column in selected_columns if column not in manifest['columns']]
+        if missing_columns:
+            raise ValueError('Columns not in "' + os.path.basename(path_2_file) + '": ' + str(missing_columns))
+        # Same order as in the file, as with pd.read_csv(usecols=...)
+        columns = [column for column in manifest['columns'] if column in selected_columns]
+    data = {}
+    for column in columns:
+        path_2_column = os.path.join(cache_folder, manifest['files'][column])
+        if column in manifest['object_columns']:
+            # Python objects (e.g., strings) cannot be memory-mapped
+            data[column] = np.load(path_2_column, allow_pickle=True)
+        else:
+            data[column] = np.load(path_2_column, mmap_mode='r')
+    df = pd.DataFrame(data, columns=columns, copy=False)
+    if na_values is not None:
+        df = replace_missing_values(df, na_values)
+    return df
+
+
+def read_cached_mtmc_file_in_chunks(path_2_file, selected_columns=None, na_values=None, chunksize=100000):
+    # Reads the file by chunks of rows, so that memory stays bounded for large files. If the file is not already
+    # converted (and the cache is not up to date), the CSV-file is read directly, without converting it.
+    cache_folder = get_cache_folder(path_2_file)
+    if get_valid_manifest(path_2_file, cache_folder) is not None:
+        df = read_cached_mtmc_file(path_2_file, selected_columns=selected_columns)
+        for start in range(0, len(df), chunksize):
+            chunk = df.iloc[start:start + chunksize]
+            if na_values is not None:
+                chunk = replace_missing_values(chunk.copy(), na_values)
+            yield chunk
+    else:
+        with open(path_2_file, 'r', encoding='latin1') as source_file:
+            for chunk in pd.read_csv(source_file, usecols=selected_columns, na_values=na_values, chunksize=chunksize):
+                yield chunk
+
+
+def replace_missing_values(df, na_values):
+    # Equivalent to pd.read_csv(na_values=...): integer columns with missing values become float columns
+    for column in df.columns:
+        if pd.api.types.is_numeric_dtype(df[column]) and not pd.api.types.is_bool_dtype(df[column]):
+            is_missing = df[column].isin(na_values)
+        else:
+            is_missing = df[column].isin(na_values + [str(na_value) for na_value in na_values])
+        if is_missing.any():
+            df[column] = df[column].where(~is_missing)
+    return df
+
+
+def get_cache_folder(path_2_file):
+    return os.path.join(os.path.dirname(path_2_file), cache_folder_name, os.path.basename(path_2_file))
+
+
+def get_valid_manifest(path_2_file, cache_folder):
+    path_2_manifest = os.path.join(cache_folder, manifest_file_name)
+    if not os.path.isfile(path_2_manifest):
+        return None
+    with open(path_2_manifest, 'r') as manifest_file:
+        manifest = json.load(manifest_file)
+    source_stat = os.stat(path_2_file)
+    if manifest['size'] != source_stat.st_size:
+        return None
+    if manifest['mtime_ns'] != source_stat.st_mtime_ns:
+        # The file has been touched or copied again: the cache stays valid only if the content is the same
+        if manifest['sha256'] != get_sha256(path_2_file):
+            return None
+        manifest['mtime_ns'] = source_stat.st_mtime_ns
+        write_manifest(manifest, path_2_manifest)
+    return manifest
+
+
+def write_cache(path_2_file, cache_folder):
+    os.makedirs(cache_folder, exist_ok=True)
+    path_2_manifest = os.path.join(cache_folder, manifest_file_name)
+    # The manifest is written last, so that an interrupted conversion is never considered as valid
+    if os.path.isfile(path_2_manifest):
+        os.remove(path_2_manifest)
+    source_stat = os.stat(path_2_file)
+    sha256 = get_sha256(path_2_file)
+    with open(path_2_file, 'r', encoding='latin1') as source_file:
+        df = pd.read_csv(source_file)
+    manifest = {'size': source_stat.st_size,
+                'mtime_ns': source_stat.st_mtime_ns,
+                'sha256': sha256,
+                'columns': [],
+                'files': {},
+                'object_columns': []}
+    for i, column in enumerate(df.columns):
+        series = df[column]
+        if pd.api.types.is_integer_dtype(series):
+            # Codes (e.g., dmod, f70801, f70700_01) fit in int8/int16
+            series = pd.to_numeric(series, downcast='integer')
+        array = series.to_numpy()
+        if array.dtype == object:
+            manifest['object_columns'].append(column)
+        file_name = str(i) + '.npy'
+        np.save(os.path.join(cache_folder, file_name), array, allow_pickle=array.dtype == object)
+        manifest['columns'].append(column)
+        manifest['files'][column] = file_name
+    write_manifest(manifest, path_2_manifest)
+    return manifest
+
+
+def write_manifest(manifest, path_2_manifest):
+    with open(path_2_manifest, 'w') as manifest_file:
+        json.dump(manifest, manifest_file)
+
+
+def get_sha256(path_2_file):
+    sha256 = hashlib.sha256()
+    with open(path_2_file, 'rb') as source_file:
+        for block in iter(lambda: source_file.read(1024 * 1024), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def get_sha256_of_mtmc_file(path_2_file):
+    # From the manifest of the cache if it is up to date, otherwise computed from the file (without converting it)
+    manifest = get_valid_manifest(path_2_file, get_cache_folder(path_2_file))
+    if manifest is None:
+        return get_sha256(path_2_file)
+    return manifest['sha256']
@@ -0,0 +1,142 @@
+import pandas as pd
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from utils_mtmc.weighted_statistics import get_weighted_averages_and_stds_by_group, get_group_codes
+
+
+# Empirical variance of the weighted averages, instead of the design effect (1.14) used in
+# get_weighted_averages_and_stds_by_group. The weights WP are redrawn by household (HHNR) for each replicate, either
+# by bootstrap (households drawn with replacement) or by delete-a-group jackknife (households split randomly in as
+# many groups as replicates, each replicate removing one group). The weight correction for people declaring trips
+# without detailing them (WP_corrected) and the weighted averages are then recomputed for each replicate.
+# Replicates are computed by chunks (persons x replicates weight matrices), in parallel in worker processes.
+replicate_arrays = {}  # Arrays shared by all the chunks computed in a (worker) process
+
+
+def get_replicate_weighted_averages_and_stds_by_group(df_zp, df_zp_declared, groups, name_variables,
+                                                      method='bootstrap', nb_of_replicates=1000, seed=0,
+                                                      max_chunk_size_in_bytes=256 * 1024 ** 2, max_workers=None):
+    # df_zp contains the persons used for the estimation, with the columns HHNR, WP, with_trips and name_variables.
+    # df_zp_declared contains all persons declaring their number of trips (HHNR, WP, with_trips), including those
+    # later removed because their trips are not detailed. It is used to correct the weights of people with trips.
+    # Returns the same DataFrame as get_weighted_averages_and_stds_by_group, with the weighted average of the full
+    # sample and the half-width of the 90%-confidence interval based on the replicates.
+    _, output = get_replicate_weighted_averages_and_stds_in_total_and_by_group(df_zp, df_zp_declared, groups,
+                                                                               name_variables, method,
+                                                                               nb_of_replicates, seed,
+                                                                               max_chunk_size_in_bytes, max_workers)
+    return output
+
+
+def get_replicate_weighted_averages_and_stds_in_total_and_by_group(df_zp, df_zp_declared, groups, name_variables,
+                                                                   method='bootstrap', nb_of_replicates=1000, seed=0,
+                                                                   max_chunk_size_in_bytes=256 * 1024 ** 2,
+                                                                   max_workers=None):
+    # Same as get_replicate_weighted_averages_and_stds_by_group, but returns the results for all persons (as with
+    # groups=None) and by group, computed from the same replicates, drawn only once
+    if method not in ['bootstrap', 'jackknife']:
+        raise Exception('Method for the replicates not well defined')
+    if nb_of_replicates < 2:
+        raise Exception('Number of replicates not well defined (at least 2)')
+    output_total = get_weighted_averages_and_stds_by_group(df_zp, None, name_variables)
+    output = get_weighted_averages_and_stds_by_group(df_zp, groups, name_variables)
+    group_codes, group_labels = get_group_codes(df_zp, groups)
+    # Persons without group (e.g., outside of the bins of pd.cut) are in an additional group, only used in the total
+    group_codes = np.where(group_codes >= 0, group_codes, len(group_labels))
+    # Persons sorted by group, so that sums by group can be computed with np.add.reduceat
+    sorted_persons = np.argsort(group_codes, kind='stable')
+    sorted_group_codes = group_codes[sorted_persons]
+    group_starts = np.flatnonzero(np.r_[True, sorted_group_codes[1:] != sorted_group_codes[:-1]])
+    observed_groups = np.unique(sorted_group_codes)
+    observed_groups = observed_groups[observed_groups < len(group_labels)]
+    # Households, on which the replicates are drawn
+    household_codes_declared, households = pd.factorize(df_zp_declared['HHNR'])
+    household_codes = households.get_indexer(df_zp['HHNR'])
+    if method == 'jackknife':
+        household_groups = np.random.default_rng(seed).permutation(len(households)) % nb_of_replicates
+    else:
+        household_groups = None
+    arrays = {'nb_of_households': len(households),
+              'household_codes_declared': household_codes_declared,
+              'weights_declared_with_trips': np.where(df_zp_declared['with_trips'], df_zp_declared['WP'], 0),
+              'household_codes': household_codes[sorted_persons],
+              'weights': df_zp['WP'].to_numpy(dtype=float)[sorted_persons],
+              'with_trips': df_zp['with_trips'].to_numpy()[sorted_persons],
+              'values': np.nan_to_num(df_zp[name_variables].to_numpy(dtype=float)[sorted_persons]),
+              'group_starts': group_starts,
+              'method': method,
+              'nb_of_replicates': nb_of_replicates,
+              'household_groups': household_groups}
+    # Chunks of replicates, so that the matrices of weights (persons x replicates) fit in memory
+    size_of_replicate_in_bytes = 8 * (len(df_zp_declared) + len(df_zp) * (2 + len(name_variables)))
+    chunk_size = max(1, min(nb_of_replicates, int(max_chunk_size_in_bytes // size_of_replicate_in_bytes)))
+    chunks = [range(start, min(start + chunk_size, nb_of_replicates))
+              for start in range(0, nb_of_replicates, chunk_size)]
+    # One seed by replicate, so that the draws only depend on the seed and the number of the replicate (not on the
+    # size of the chunks or the number of workers)
+    replicate_seeds = np.random.SeedSequence(seed).spawn(nb_of_replicates)
+    chunk_seeds = [replicate_seeds[chunk.start:chunk.stop] for chunk in chunks]
+    if max_workers == 1 or len(chunks) == 1:
+        set_replicate_arrays(arrays)
+        replicate_sums = [get_replicate_weighted_sums(chunk, seeds_of_chunk)
+                          for chunk, seeds_of_chunk in zip(chunks, chunk_seeds)]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=set_replicate_arrays,
+                                 initargs=(arrays,)) as executor:
+            replicate_sums = list(executor.map(get_replicate_weighted_sums, chunks, chunk_seeds))
+    # Dimensions: replicates x groups (x variables)
+    sum_of_weights = np.concatenate([sums_of_chunk[0] for sums_of_chunk in replicate_sums], axis=0)
+    weighted_sums = np.concatenate([sums_of_chunk[1] for sums_of_chunk in replicate_sums], axis=0)
+    replicate_averages_total = weighted_sums.sum(axis=1) / sum_of_weights.sum(axis=1)[:, np.newaxis]
+    replicate_averages = weighted_sums[:, :len(observed_groups)] / \
+        sum_of_weights[:, :len(observed_groups), np.newaxis]
+    for output_of_groups, averages, index in [(output_total, replicate_averages_total[:, np.newaxis, :],
+                                               output_total.index),
+                                              (output, replicate_averages, group_labels[observed_groups])]:
+        weighted_std = pd.DataFrame(get_half_widths(averages, method, nb_of_replicates), index=index,
+                                    columns=name_variables)
+        for name_variable in name_variables:
+            output_of_groups[(name_variable, 'weighted_std')] = weighted_std[name_variable]
+    return output_total, output
+
+
+def get_half_widths(replicate_averages, method, nb_of_replicates):
+    # Half-width of the 90%-confidence interval, from the replicate averages (replicates x groups x variables)
+    if method == 'bootstrap':
+        variance = np.var(replicate_averages, axis=0, ddof=1)
+    else:
+        variance = (nb_of_replicates - 1) / nb_of_replicates * \
+                   ((replicate_averages - replicate_averages.mean(axis=0)) ** 2).sum(axis=0)
+    return 1.645 * np.sqrt(variance)
+
+
+def set_replicate_arrays(arrays):
+    replicate_arrays.clear()
+    replicate_arrays.update(arrays)
+
+
+def get_replicate_weighted_sums(replicates, replicate_seeds):
+    arrays = replicate_arrays
+    # Factors of the weights by household and replicate
+    if arrays['method'] == 'bootstrap':
+        nb_of_households = arrays['nb_of_households']
+        probabilities = np.full(nb_of_households, 1 / nb_of_households)
+        household_factors = np.column_stack([np.random.default_rng(replicate_seed).multinomial(nb_of_households,
+                                                                                               probabilities)
+                                             for replicate_seed in replicate_seeds]).astype(float)
+    else:
+        nb_of_replicates = arrays['nb_of_replicates']
+        household_factors = np.where(arrays['household_groups'][:, np.newaxis] == np.array(replicates),
+                                     0, nb_of_replicates / (nb_of_replicates - 1))
+    # Correction factor for people declaring they did trips, but without detailing them, by replicate
+    weight_declared_trips = \
+        arrays['weights_declared_with_trips'] @ household_factors[arrays['household_codes_declared']]
+    weights = arrays['weights'][:, np.newaxis] * household_factors[arrays['household_codes']]
+    weight_detailed_trips = arrays['with_trips'] @ weights
+    weights[arrays['with_trips']] *= weight_declared_trips / weight_detailed_trips
+    # Sum of weights and weighted sums by group, for all replicates and variables (replicates x groups (x variables)),
+    # from which the weighted averages by group and for all persons are computed
+    sum_of_weights = np.add.reduceat(weights, arrays['group_starts'], axis=0)
+    weighted_sums = np.add.reduceat(weights[:, :, np.newaxis] * arrays['values'][:, np.newaxis, :],
+                                    arrays['group_starts'], axis=0)
+    return sum_of_weights.T, np.moveaxis(weighted_sums, 1, 0)
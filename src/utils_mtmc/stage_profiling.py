@@ -0,0 +1,88 @@
+import cProfile
+import json
+import os
+import re
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+try:
+    import resource  # Not available on Windows
+except ImportError:
+    resource = None
+
+# Profiling of the stages of a computation: wall time, CPU time (of the current process, not of worker processes),
+# peak of memory allocated by Python during the stage (tracemalloc), peak resident memory of the process so far and
+# number of rows in and out. Profiling is activated by the environment variable MTMC_PROFILE=1 or by
+# enable_profiling(). With MTMC_PROFILE_CPROFILE=<folder>, a cProfile file is also saved for each stage.
+# When profiling is not activated, profile_stage does nothing. Stages must not be nested.
+profiling = {'enabled': os.environ.get('MTMC_PROFILE', '0') not in ['', '0'],
+             'path_2_cprofile': os.environ.get('MTMC_PROFILE_CPROFILE') or None,
+             'stages': []}
+
+
+def enable_profiling(path_2_cprofile=None):
+    profiling['enabled'] = True
+    if path_2_cprofile is not None:
+        profiling['path_2_cprofile'] = path_2_cprofile
+
+
+def is_profiling_enabled():
+    return profiling['enabled']
+
+
+@contextmanager
+def profile_stage(name, rows_in=None):
+    # Usage: with profile_stage('name', rows_in=len(df)) as stage: ... stage['rows_out'] = len(df)
+    stage = {'stage': name, 'rows_in': rows_in, 'rows_out': None}
+    if not profiling['enabled']:
+        yield stage
+        return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    memory_at_start, _ = tracemalloc.get_traced_memory()
+    profiler = None
+    if profiling['path_2_cprofile'] is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    wall_time_at_start = time.perf_counter()
+    cpu_time_at_start = time.process_time()
+    try:
+        yield stage
+    finally:
+        stage['wall_time_in_s'] = time.perf_counter() - wall_time_at_start
+        stage['cpu_time_in_s'] = time.process_time() - cpu_time_at_start
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(profiling['path_2_cprofile'], exist_ok=True)
+            file_name = str(len(profiling['stages'])).zfill(2) + '_' + re.sub(r'\W+', '_', name) + '.prof'
+            profiler.dump_stats(os.path.join(profiling['path_2_cprofile'], file_name))
+        _, peak_memory = tracemalloc.get_traced_memory()
+        stage['tracemalloc_peak_increase_in_mb'] = (peak_memory - memory_at_start) / 1024 ** 2
+        stage['peak_rss_in_mb'] = get_peak_rss_in_mb()
+        profiling['stages'].append(stage)
+
+
+def get_peak_rss_in_mb():
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+    if sys.platform == 'darwin':
+        return peak_rss / 1024 ** 2
+    return peak_rss / 1024
+
+
+def get_profiling_report():
+    return {'stages': list(profiling['stages']),
+            'total_wall_time_in_s': sum(stage['wall_time_in_s'] for stage in profiling['stages'])}
+
+
+def save_profiling_report(path_2_report):
+    with open(path_2_report, 'w') as report_file:
+        json.dump(get_profiling_report(), report_file, indent=4)
+
+
+def reset_profiling():
+    profiling['stages'].clear()
@@ -0,0 +1,130 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+
+# Stages of a computation, with their results kept in an on-disk store, so that a new run only recomputes the stages
+# whose inputs changed. A stage is defined by a function, its parameters and its upstream stages (whose results are
+# the first arguments of the function). The key of a stage is the SHA-256 hash of its name, the source code of its
+# function and of the functions it calls (called_functions), its parameters, other data (key_data, e.g., the hashes of
+# the input files or codes used by the function) and the keys of its upstream stages: a change invalidates the stage
+# and all stages downstream of it, but not the stages upstream of it. Settings used by the functions (e.g., module-level
+# dicts) are not in their source code and must be in the parameters or in key_data.
+# Results are pickled in <store>/<key>.pkl. When the store is larger than max_size_in_bytes, the least recently used
+# results are removed. Stages are computed lazily: the stages upstream of a result found in the store are not computed.
+# Results can contain personal data (e.g., persons with their distances): the default store is in the cache of the
+# input files (data/input/cache), which must not be committed or shared either
+default_path_2_store = os.path.join('..', 'data', 'input', 'cache', 'stage_store')
+default_max_size_in_bytes = 2 * 1024 ** 3
+
+
+def define_stage(name, function, parameters=None, upstream_stages=(), key_data=None, ignored_in_key=(), persist=True,
+                 is_valid_result=None, called_functions=()):
+    # called_functions: functions called by function, whose changes must invalidate the stage
+    # ignored_in_key: names of parameters that do not change the result (e.g., the size of chunks)
+    # persist: False for results that are not worth storing (e.g., data read from the cache of the input files)
+    # is_valid_result: function checking a result found in the store (e.g., that the files it wrote are unchanged)
+    if parameters is None:
+        parameters = {}
+    upstream_stages = list(upstream_stages)
+    key = get_stage_key(name, function,
+                        {name_parameter: value for name_parameter, value in parameters.items()
+                         if name_parameter not in ignored_in_key},
+                        key_data, [upstream_stage['key'] for upstream_stage in upstream_stages], called_functions)
+    return {'name': name,
+            'key': key,
+            'function': function,
+            'parameters': parameters,
+            'upstream_stages': upstream_stages,
+            'persist': persist,
+            'is_valid_result': is_valid_result,
+            'status': None}
+
+
+def get_stage_key(name, function, parameters, key_data, upstream_keys, called_functions=()):
+    stage_description = {'name': name,
+                         'function': function.__qualname__,  # Not the module, which is __main__ in a script
+                         'source': inspect.getsource(function),
+                         'called_functions': {called_function.__qualname__: inspect.getsource(called_function)
+                                              for called_function in called_functions},
+                         'parameters': parameters,
+                         'key_data': key_data,
+                         'upstream_keys': upstream_keys}
+    return hashlib.sha256(json.dumps(stage_description, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def get_stage_result(stage, path_2_store=None, max_size_in_bytes=default_max_size_in_bytes):
+    # Without store (path_2_store is None), results are only kept in memory, during the run.
+    # stage['status'] is then 'computed' or 'loaded' (from the store).
+    if stage['status'] is not None:
+        return stage['result']
+    if path_2_store is not None and stage['persist']:
+        is_in_store, result = load_stage_result(stage['key'], path_2_store)
+        if is_in_store and (stage['is_valid_result'] is None or stage['is_valid_result'](result)):
+            stage['result'] = result
+            stage['status'] = 'loaded'
+            return result
+    upstream_results = [get_stage_result(upstream_stage, path_2_store, max_size_in_bytes)
+                        for upstream_stage in stage['upstream_stages']]
+    result = stage['function'](*upstream_results, **stage['parameters'])
+    if path_2_store is not None and stage['persist']:
+        save_stage_result(stage['key'], result, path_2_store, max_size_in_bytes)
+    stage['result'] = result
+    stage['status'] = 'computed'
+    return result
+
+
+def load_stage_result(key, path_2_store):
+    path_2_result = os.path.join(path_2_store, key + '.pkl')
+    try:
+        with open(path_2_result, 'rb') as result_file:
+            result = pickle.load(result_file)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return False, None
+    # The modification time is the time of the last use (for the eviction of the least recently used results)
+    os.utime(path_2_result)
+    return True, result
+
+
+def save_stage_result(key, result, path_2_store, max_size_in_bytes=default_max_size_in_bytes):
+    os.makedirs(path_2_store, exist_ok=True)
+    path_2_result = os.path.join(path_2_store, key + '.pkl')
+    # Write to a temporary file first, so that an interrupted writing is never taken from the store
+    with open(path_2_result + '.tmp', 'wb') as result_file:
+        pickle.dump(result, result_file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(path_2_result + '.tmp', path_2_result)
+    remove_least_recently_used_results(path_2_store, max_size_in_bytes, kept_key=key)
+
+
+def remove_least_recently_used_results(path_2_store, max_size_in_bytes, kept_key=None):
+    # The result just saved (kept_key) is never removed, even if it is larger than the store
+    results = []
+    for file_name in os.listdir(path_2_store):
+        if file_name.endswith('.pkl'):
+            file_stat = os.stat(os.path.join(path_2_store, file_name))
+            results.append((file_stat.st_mtime_ns, file_stat.st_size, file_name))
+    size_of_store = sum(size for _, size, _ in results)
+    for _, size, file_name in sorted(results):
+        if size_of_store <= max_size_in_bytes:
+            break
+        if file_name != str(kept_key) + '.pkl':
+            os.remove(os.path.join(path_2_store, file_name))
+            size_of_store -= size
+
+
+def get_sha256_of_files(paths_2_files):
+    # Result of the stages writing files: {path of the file: SHA-256 hash of its content}
+    sha256_by_file = {}
+    for path_2_file in paths_2_files:
+        with open(path_2_file, 'rb') as written_file:
+            sha256_by_file[path_2_file] = hashlib.sha256(written_file.read()).hexdigest()
+    return sha256_by_file
+
+
+def are_files_unchanged(sha256_by_file):
+    # The files written by a stage are still there, without change (e.g., not replaced by another run)
+    for path_2_file, sha256 in sha256_by_file.items():
+        if not os.path.isfile(path_2_file) or get_sha256_of_files([path_2_file])[path_2_file] != sha256:
+            return False
+    return True
@@ -0,0 +1,75 @@
+import pandas as pd
+import numpy as np
+import os
+
+# Synthetic files with the same structure as the files of the MTMC 2015 used in this code (zielpersonen.csv and
+# reisenmueb.csv), for tests and benchmarks without the (confidential) data. Distributions are only roughly
+# realistic: about a third of the persons answer the module about trips with overnights (module 1b), half of them
+# made at least one trip in the 4 last months, and up to 3 trips are detailed by person. About a quarter of the
+# trips are made by plane. Missing values are coded -99 in the trips, and -97/-98 for the number of trips.
+mode_codes = [17, 9, 2, 7, 4, 20]  # plane, car, train, coach, boat, other
+mode_probabilities = [0.25, 0.45, 0.18, 0.05, 0.03, 0.04]
+trip_goal_codes = list(range(1, 18))
+trip_goal_probabilities = np.array([1, 3, 2, 10, 20, 2, 4, 4, 1, 2, 2, 10, 35, 1, 1, 1, 1]) / 100
+
+
+def generate_synthetic_mtmc_files(path_2_folder, nb_of_persons=17000, seed=0, chunk_size=1000000):
+    # Files are written by chunks of persons, so that memory stays bounded for large numbers of persons
+    os.makedirs(path_2_folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    path_2_zielpersonen = os.path.join(path_2_folder, 'zielpersonen.csv')
+    path_2_reisenmueb = os.path.join(path_2_folder, 'reisenmueb.csv')
+    first_trip_number = 1
+    for start in range(0, nb_of_persons, chunk_size):
+        df_zp = get_synthetic_persons(rng, start, min(chunk_size, nb_of_persons - start))
+        df_trips = get_synthetic_overnight_trips(rng, df_zp, first_trip_number)
+        first_trip_number += len(df_trips)
+        df_zp.to_csv(path_2_zielpersonen, mode='w' if start == 0 else 'a', header=start == 0, index=False,
+                     encoding='latin1')
+        df_trips.to_csv(path_2_reisenmueb, mode='w' if start == 0 else 'a', header=start == 0, index=False,
+                        encoding='latin1')
+
+
+def get_synthetic_persons(rng, start, nb_of_persons):
+    dmod = rng.choice([1, 2, 3], size=nb_of_persons, p=[0.35, 0.35, 0.3])
+    nb_of_trips = np.where(rng.random(nb_of_persons) < 0.5, 0, 1 + rng.poisson(0.8, nb_of_persons))
+    nb_of_trips = np.where(rng.random(nb_of_persons) < 0.01, rng.choice([-97, -98], size=nb_of_persons), nb_of_trips)
+    nb_of_trips = np.where(dmod == 2, nb_of_trips, -99)  # Only asked in module 1b
+    return pd.DataFrame({'HHNR': 100000 + start + np.arange(nb_of_persons),
+                         'WP': rng.lognormal(0, 0.5, nb_of_persons).round(6),
+                         'dmod': dmod,
+                         'f70100': nb_of_trips,
+                         'alter': rng.integers(6, 100, nb_of_persons)})
+
+
+def get_synthetic_overnight_trips(rng, df_zp, first_trip_number):
+    # Up to 3 trips detailed by person, some persons do not detail any trip
+    nb_of_detailed_trips = np.minimum(np.maximum(df_zp['f70100'].to_numpy(), 0), 3)
+    nb_of_detailed_trips = np.where(rng.random(len(df_zp)) < 0.03, 0, nb_of_detailed_trips)
+    person_of_trips = np.repeat(np.arange(len(df_zp)), nb_of_detailed_trips)
+    nb_of_trips = len(person_of_trips)
+    # Number of the trip for the person
+    trip_numbers = np.arange(nb_of_trips) - np.repeat(np.cumsum(nb_of_detailed_trips) - nb_of_detailed_trips,
+                                                      nb_of_detailed_trips) + 1
+    main_transport_mode = rng.choice(mode_codes, size=nb_of_trips, p=mode_probabilities)
+    is_by_plane = main_transport_mode == 17
+    # Distances in km (outward and return journeys and distances at destination)
+    trip_distance = np.where(is_by_plane,
+                             rng.lognormal(8, 0.9, nb_of_trips),
+                             rng.lognormal(5.5, 0.8, nb_of_trips)).round()
+    trip_distance_in_ch = np.minimum(trip_distance, rng.lognormal(4, 0.8, nb_of_trips).round())
+    return pd.DataFrame({'HHNR': df_zp['HHNR'].to_numpy()[person_of_trips],
+                         'WP': df_zp['WP'].to_numpy()[person_of_trips],
+                         'RENR': first_trip_number + np.arange(nb_of_trips),
+                         'reisenr': trip_numbers,
+                         'f70700_01': with_missing_values(rng, rng.choice(trip_goal_codes, size=nb_of_trips,
+                                                                          p=trip_goal_probabilities), 0.005),
+                         'f70801': with_missing_values(rng, main_transport_mode, 0.005),
+                         'f71300': rng.integers(1, 30, nb_of_trips),
+                         'f71400_01': rng.integers(1, 5, nb_of_trips),
+                         'f71600b': with_missing_values(rng, trip_distance.astype(int), 0.03),
+                         'f71700b': with_missing_values(rng, trip_distance_in_ch.astype(int), 0.03)})
+
+
+def with_missing_values(rng, values, share_of_missing_values):
+    return np.where(rng.random(len(values)) < share_of_missing_values, -99, values)
@@ -0,0 +1,127 @@
+import pandas as pd
+import numpy as np
+
+# Cube of sufficient statistics of weighted averages: for each combination of the levels of the dimensions (e.g.,
+# each age in years), the sum of weights, the weighted sum and the weighted sum of squares of each variable, and the
+# number of observations. Weighted averages and confidence intervals for any breakdown (groups of levels defined by
+# bin edges, combinations of dimensions, filters) are then computed from the cube, without the observations.
+# The results are the same as with get_weighted_averages_and_stds_by_group, up to rounding errors.
+
+
+def get_weighted_cube(df_zp, dimensions, name_variables, name_weight='WP_corrected', id_column='HHNR'):
+    # Observations with a missing value in a dimension are not in the cube
+    levels = []
+    level_codes = []
+    for dimension in dimensions:
+        codes, dimension_levels = pd.factorize(df_zp[dimension], sort=True)
+        dimension_levels = np.asarray(dimension_levels)
+        if dimension_levels.dtype == object:
+            dimension_levels = dimension_levels.astype(str)  # So that the cube can be saved without pickle
+        levels.append(dimension_levels)
+        level_codes.append(codes)
+    shape = tuple(len(dimension_levels) for dimension_levels in levels)
+    is_in_cube = np.logical_and.reduce([codes >= 0 for codes in level_codes])
+    cell_codes = np.ravel_multi_index([codes[is_in_cube] for codes in level_codes], shape)
+    nb_of_cells = int(np.prod(shape))
+    weights = df_zp[name_weight].to_numpy(dtype=float)[is_in_cube]
+    # Missing values are ignored (as in pandas)
+    values = np.nan_to_num(df_zp[name_variables].to_numpy(dtype=float)[is_in_cube])
+    unique_cells_and_ids = np.unique(np.column_stack([cell_codes, df_zp[id_column].to_numpy()[is_in_cube]]), axis=0)
+    cube = {'dimensions': list(dimensions),
+            'levels': levels,
+            'name_variables': list(name_variables),
+            'nb_of_obs': np.bincount(unique_cells_and_ids[:, 0], minlength=nb_of_cells).reshape(shape),
+            'sum_of_weights': np.bincount(cell_codes, weights=weights, minlength=nb_of_cells).reshape(shape),
+            'weighted_sums': np.zeros(shape + (len(name_variables),)),
+            'weighted_sums_of_squares': np.zeros(shape + (len(name_variables),))}
+    for i in range(len(name_variables)):
+        cube['weighted_sums'][..., i] = np.bincount(cell_codes, weights=weights * values[:, i],
+                                                    minlength=nb_of_cells).reshape(shape)
+        cube['weighted_sums_of_squares'][..., i] = np.bincount(cell_codes, weights=weights * values[:, i] ** 2,
+                                                               minlength=nb_of_cells).reshape(shape)
+    return cube
+
+
+def query_weighted_cube(cube, by=None, bins=None, labels=None, filters=None, name_variables=None):
+    # by: list of dimensions of the breakdown (None for all observations together)
+    # bins: {dimension: bin edges}, to group levels of a dimension of by (as with pd.cut, i.e. (edge, next edge])
+    # labels: {dimension: labels of the bins}
+    # filters: {dimension: list of levels}, to keep only some levels (of any dimension)
+    # Returns the same DataFrame as get_weighted_averages_and_stds_by_group (one row by observed group)
+    if by is None:
+        by = []
+    bins = bins or {}
+    labels = labels or {}
+    filters = filters or {}
+    if name_variables is None:
+        name_variables = cube['name_variables']
+    variable_positions = [cube['name_variables'].index(name_variable) for name_variable in name_variables]
+    # Groups of levels, by dimension
+    group_codes = []
+    group_labels = []
+    for dimension in by:
+        dimension_levels = cube['levels'][cube['dimensions'].index(dimension)]
+        if dimension in bins:
+            categories = pd.cut(dimension_levels, bins[dimension], labels=labels.get(dimension))
+            group_codes.append(np.asarray(categories.codes))
+            group_labels.append(pd.Index(categories.categories, name=dimension))
+        else:
+            group_codes.append(np.arange(len(dimension_levels)))
+            group_labels.append(pd.Index(dimension_levels, name=dimension))
+    # Group of each cell of the cube (-1 if the cell is not used)
+    shape = cube['sum_of_weights'].shape
+    cell_group_codes = np.zeros(shape, dtype=np.int64)
+    is_used = np.ones(shape, dtype=bool)
+    groups_shape = tuple(len(dimension_labels) for dimension_labels in group_labels)
+    for dimension, codes, nb_of_groups in zip(by, group_codes, groups_shape):
+        axis = cube['dimensions'].index(dimension)
+        codes_along_axis = codes.reshape([-1 if i == axis else 1 for i in range(len(shape))])
+        cell_group_codes = cell_group_codes * nb_of_groups + codes_along_axis
+        is_used &= codes_along_axis >= 0
+    for dimension, selected_levels in filters.items():
+        axis = cube['dimensions'].index(dimension)
+        is_selected = np.isin(cube['levels'][axis], selected_levels)
+        is_used &= is_selected.reshape([-1 if i == axis else 1 for i in range(len(shape))])
+    cell_group_codes = cell_group_codes[is_used]
+    nb_of_groups = int(np.prod(groups_shape))
+    # Roll-up of the sufficient statistics by group
+    nb_of_obs = np.bincount(cell_group_codes, weights=cube['nb_of_obs'][is_used], minlength=nb_of_groups)
+    sum_of_weights = np.bincount(cell_group_codes, weights=cube['sum_of_weights'][is_used], minlength=nb_of_groups)
+    output = {}
+    for name_variable, position in zip(name_variables, variable_positions):
+        weighted_sums = np.bincount(cell_group_codes, weights=cube['weighted_sums'][..., position][is_used],
+                                    minlength=nb_of_groups)
+        weighted_sums_of_squares = np.bincount(cell_group_codes,
+                                               weights=cube['weighted_sums_of_squares'][..., position][is_used],
+                                               minlength=nb_of_groups)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weighted_avg = weighted_sums / sum_of_weights
+            variance = np.maximum(weighted_sums_of_squares - weighted_sums * weighted_avg, 0) / (sum_of_weights - 1)
+            weighted_std = 1.645 * 1.14 * np.sqrt(variance) / np.sqrt(nb_of_obs)
+        output[(name_variable, 'weighted_avg')] = weighted_avg
+        output[(name_variable, 'weighted_std')] = weighted_std
+    if by:
+        index = pd.MultiIndex.from_product(group_labels) if len(by) > 1 else group_labels[0]
+    else:
+        index = pd.Index(['all'])
+    output = pd.DataFrame(output, index=index)
+    return output[nb_of_obs > 0]
+
+
+def save_weighted_cube(cube, path_2_cube):
+    np.savez(path_2_cube, dimensions=np.array(cube['dimensions']), name_variables=np.array(cube['name_variables']),
+             nb_of_obs=cube['nb_of_obs'], sum_of_weights=cube['sum_of_weights'],
+             weighted_sums=cube['weighted_sums'], weighted_sums_of_squares=cube['weighted_sums_of_squares'],
+             **{'levels_' + str(i): dimension_levels for i, dimension_levels in enumerate(cube['levels'])})
+
+
+def load_weighted_cube(path_2_cube):
+    with np.load(path_2_cube) as cube_file:
+        dimensions = [str(dimension) for dimension in cube_file['dimensions']]
+        return {'dimensions': dimensions,
+                'levels': [cube_file['levels_' + str(i)] for i in range(len(dimensions))],
+                'name_variables': [str(name_variable) for name_variable in cube_file['name_variables']],
+                'nb_of_obs': cube_file['nb_of_obs'],
+                'sum_of_weights': cube_file['sum_of_weights'],
+                'weighted_sums': cube_file['weighted_sums'],
+                'weighted_sums_of_squares': cube_file['weighted_sums_of_squares']}
@@ -0,0 +1,64 @@
+import pandas as pd
+import numpy as np
+
+
+def get_weighted_averages_and_stds_by_group(df_zp, groups, name_variables, name_weight='WP_corrected',
+                                            id_column='HHNR'):
+    # Same results as df_zp.groupby(groups).apply(get_weighted_average_and_std, name_variable), but for all groups
+    # and all variables at once. groups is a Series aligned with df_zp (e.g., the result of pd.cut), or None for a
+    # single group containing all observations. Observations whose group is not defined (NaN) are not used.
+    # Returns a DataFrame with one row per (observed) group and columns (name_variable, 'weighted_avg') and
+    # (name_variable, 'weighted_std'), where 'weighted_std' is the half-width of the 90%-confidence interval.
+    group_codes, group_labels = get_group_codes(df_zp, groups)
+    is_in_group = group_codes >= 0
+    group_codes = group_codes[is_in_group]
+    nb_of_groups = len(group_labels)
+    nb_of_variables = len(name_variables)
+    weights = df_zp[name_weight].to_numpy(dtype=float)[is_in_group]
+    values = df_zp[name_variables].to_numpy(dtype=float)[is_in_group]
+    # Number of observations (persons) by group
+    unique_codes_and_ids = np.unique(np.column_stack([group_codes, df_zp[id_column].to_numpy()[is_in_group]]), axis=0)
+    nb_of_obs = np.bincount(unique_codes_and_ids[:, 0], minlength=nb_of_groups)
+    # Sum of weights and weighted sum of each variable by group (missing values are ignored, as in pandas)
+    sum_of_weights = np.bincount(group_codes, weights=weights, minlength=nb_of_groups)
+    cell_codes = (group_codes[:, np.newaxis] * nb_of_variables + np.arange(nb_of_variables)).ravel()
+    weighted_values = weights[:, np.newaxis] * values
+    weighted_sums = get_sums_by_cell(cell_codes, weighted_values, nb_of_groups * nb_of_variables)
+    weighted_avg = weighted_sums.reshape(nb_of_groups, nb_of_variables) / sum_of_weights[:, np.newaxis]
+    # Weighted variance, computed around the weighted average of the group
+    squared_deviations = weights[:, np.newaxis] * (values - weighted_avg[group_codes]) ** 2
+    variance = get_sums_by_cell(cell_codes, squared_deviations, nb_of_groups * nb_of_variables)
+    variance = variance.reshape(nb_of_groups, nb_of_variables) / (sum_of_weights[:, np.newaxis] - 1)
+    weighted_std = 1.645 * 1.14 * np.sqrt(variance) / np.sqrt(nb_of_obs)[:, np.newaxis]
+    output = {}
+    for i, name_variable in enumerate(name_variables):
+        output[(name_variable, 'weighted_avg')] = weighted_avg[:, i]
+        output[(name_variable, 'weighted_std')] = weighted_std[:, i]
+    output = pd.DataFrame(output, index=group_labels)
+    return output[nb_of_obs > 0]
+
+
+def get_group_codes(df_zp, groups):
+    if groups is None:
+        return np.zeros(len(df_zp), dtype=np.int64), pd.Index(['all'])
+    if isinstance(groups.dtype, pd.CategoricalDtype):
+        group_labels = pd.Index(groups.cat.categories, name=groups.name)
+        return groups.cat.codes.to_numpy().astype(np.int64), group_labels
+    group_codes, group_labels = pd.factorize(groups, sort=True)
+    return group_codes.astype(np.int64), pd.Index(group_labels, name=groups.name)
+
+
+def get_sums_by_cell(cell_codes, values, nb_of_cells):
+    values = values.ravel()
+    return np.bincount(cell_codes, weights=np.where(np.isnan(values), 0, values), minlength=nb_of_cells)
+
+
+def get_weighted_average_and_std(df_zp, name_variable):
+    # Reference implementation for a single group and a single variable (used in previous versions of the code and in
+    # the tests): weighted average and half-width of the 90%-confidence interval, with a design effect of 1.14
+    nb_of_obs = len(df_zp['HHNR'].unique())
+    weighted_avg = (df_zp[name_variable] * df_zp['WP_corrected']).sum() / df_zp['WP_corrected'].sum()
+    variance = np.divide((df_zp['WP_corrected'] * ((df_zp[name_variable] - weighted_avg) ** 2)).sum(),
+                         df_zp['WP_corrected'].sum() - 1)
+    weighted_std = np.divide(1.645 * 1.14 * np.sqrt(variance), np.sqrt(nb_of_obs))
+    return weighted_avg, weighted_std
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The code is run from the folder src (see README.md), where its modules are imported from
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
@@ -0,0 +1,134 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from utils_mtmc.synthetic_mtmc import generate_synthetic_mtmc_files
+from utils_mtmc.weighted_statistics import get_weighted_averages_and_stds_by_group, get_weighted_average_and_std
+from utils_mtmc.weighted_cube import get_weighted_cube, query_weighted_cube
+from utils_mtmc.replicate_weights import get_replicate_weighted_averages_and_stds_by_group
+from utils_mtmc.stage_store import get_stage_result
+from run_distance_by_plane_in_switzerland_in_2015 import run_distance_by_plane_in_switzerland_in_2015, \
+    get_input_data, compute_distance_by_plane, get_persons_with_distances_by_plane, get_stages, \
+    trip_goals_agg_by_suffix, col_titles_by_suffix, age_bins, age_labels
+from benchmark_distance_by_plane import reference_scale, get_differences
+
+# Tests on synthetic data (see utils_mtmc/synthetic_mtmc.py), at the scale of the reference results of the benchmark
+path_2_reference_results = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'benchmark',
+                                        'reference_results.json')
+name_variables = ['average_plane_dist' + suffix for suffix in trip_goals_agg_by_suffix]
+
+
+@pytest.fixture(scope='module')
+def path_2_input(tmp_path_factory):
+    path_2_input = str(tmp_path_factory.mktemp('input'))
+    generate_synthetic_mtmc_files(path_2_input, nb_of_persons=reference_scale)
+    return path_2_input
+
+
+@pytest.fixture(scope='module')
+def persons(path_2_input):
+    df_zp, df_overnight_trips = get_input_data(2015, path_2_input)
+    return get_persons_with_distances_by_plane(df_zp, df_overnight_trips, 2015)
+
+
+def test_results_are_the_reference_results(path_2_input, tmp_path):
+    run_distance_by_plane_in_switzerland_in_2015(outputs=('json',), figures=False, path_2_input=path_2_input,
+                                                 path_2_output=str(tmp_path))
+    with open(os.path.join(str(tmp_path), 'distance_by_plane_by_age.json'), 'r') as results_file:
+        results = json.load(results_file)
+    with open(path_2_reference_results, 'r') as reference_file:
+        reference_results = json.load(reference_file)
+    assert get_differences(reference_results, results) == []
+
+
+def test_streaming_mode_gives_the_same_results(path_2_input):
+    df_zp, df_overnight_trips = get_input_data(2015, path_2_input)
+    results = compute_distance_by_plane(df_zp, df_overnight_trips, 2015)
+    df_zp, df_overnight_trips = get_input_data(2015, path_2_input, chunksize=1000)
+    results_by_chunks = compute_distance_by_plane(df_zp, df_overnight_trips, 2015)
+    for output, output_by_chunks in zip(results[:2], results_by_chunks[:2]):
+        pd.testing.assert_frame_equal(output, output_by_chunks, check_exact=True)
+    assert results[2] == results_by_chunks[2]
+
+
+def test_streaming_mode_without_cache_gives_the_same_results(tmp_path):
+    # Without cache of the file of trips, the trips are read by chunks directly from the CSV-file
+    path_2_input = str(tmp_path)
+    generate_synthetic_mtmc_files(path_2_input, nb_of_persons=reference_scale)
+    df_zp, df_overnight_trips = get_input_data(2015, path_2_input, chunksize=1000)
+    results_by_chunks = compute_distance_by_plane(df_zp, df_overnight_trips, 2015)
+    assert not os.path.exists(os.path.join(path_2_input, 'cache', 'reisenmueb.csv'))
+    df_zp, df_overnight_trips = get_input_data(2015, path_2_input)
+    results = compute_distance_by_plane(df_zp, df_overnight_trips, 2015)
+    for output, output_by_chunks in zip(results[:2], results_by_chunks[:2]):
+        pd.testing.assert_frame_equal(output, output_by_chunks, check_exact=True)
+    assert results[2] == results_by_chunks[2]
+
+
+def test_weighted_averages_by_group_are_the_reference_implementation(persons):
+    df_zp, _ = persons
+    age_categories = pd.cut(df_zp['age'], age_bins, labels=age_labels)
+    output = get_weighted_averages_and_stds_by_group(df_zp, age_categories, name_variables)
+    for age_category, df_zp_of_category in df_zp.groupby(age_categories, observed=True):
+        for name_variable in name_variables:
+            weighted_avg, weighted_std = get_weighted_average_and_std(df_zp_of_category, name_variable)
+            assert output.loc[age_category, (name_variable, 'weighted_avg')] == pytest.approx(weighted_avg, rel=1e-12)
+            assert output.loc[age_category, (name_variable, 'weighted_std')] == pytest.approx(weighted_std, rel=1e-12)
+
+
+def test_cube_gives_the_weighted_averages_by_group(persons):
+    df_zp, _ = persons
+    cube = get_weighted_cube(df_zp, ['age'], name_variables)
+    output = query_weighted_cube(cube, by=['age'], bins={'age': age_bins}, labels={'age': age_labels})
+    expected_output = get_weighted_averages_and_stds_by_group(df_zp, pd.cut(df_zp['age'], age_bins,
+                                                                            labels=age_labels), name_variables)
+    pd.testing.assert_frame_equal(output, expected_output, check_exact=False, rtol=1e-9)
+    # Any slice, e.g. business trips of persons aged 25 to 44
+    output = query_weighted_cube(cube, filters={'age': range(25, 45)}, name_variables=['average_plane_dist_business'])
+    weighted_avg, weighted_std = get_weighted_average_and_std(df_zp[df_zp['age'].between(25, 44)],
+                                                              'average_plane_dist_business')
+    assert output.iloc[0].to_numpy() == pytest.approx([weighted_avg, weighted_std], rel=1e-9)
+
+
+@pytest.mark.parametrize('method', ['bootstrap', 'jackknife'])
+def test_replicates_do_not_depend_on_the_size_of_chunks(persons, method):
+    df_zp, df_zp_declared = persons
+    outputs = [get_replicate_weighted_averages_and_stds_by_group(df_zp, df_zp_declared, None, name_variables,
+                                                                 method=method, nb_of_replicates=20,
+                                                                 max_chunk_size_in_bytes=max_chunk_size_in_bytes,
+                                                                 max_workers=1)
+               for max_chunk_size_in_bytes in [1, 256 * 1024 ** 2]]
+    pd.testing.assert_frame_equal(outputs[0], outputs[1], check_exact=False, rtol=1e-12)
+    assert np.isfinite(outputs[0].to_numpy()).all()
+
+
+def test_store_only_recomputes_the_stages_downstream_of_a_change(path_2_input, tmp_path, monkeypatch):
+    path_2_store = str(tmp_path / 'stage_store')
+
+    def get_status_of_stages(**parameters):
+        stages = get_stages(year=2015, outputs=('csv',), figures=False, path_2_input=path_2_input,
+                            path_2_output=str(tmp_path), path_2_store=path_2_store, **parameters)
+        get_stage_result(stages['save CSV-files'], path_2_store)
+        return {name_stage: stage['status'] for name_stage, stage in stages.items()}
+
+    get_status_of_stages()
+    status_of_stages = get_status_of_stages()
+    assert status_of_stages.pop('save CSV-files') == 'loaded'
+    assert set(status_of_stages.values()) == {None}
+    # Other age categories: the persons with their distances and corrected weights are taken from the store
+    status_of_stages = get_status_of_stages(age_bins=[5, 24, 64, 100],
+                                            age_labels=['6-24 years', '25-64 years', '65 years and over'])
+    assert status_of_stages == {'load persons': None,
+                                'load overnight trips': None,
+                                'filter persons': 'loaded',
+                                'aggregate trips by person': None,
+                                'correct weights': 'loaded',
+                                'compute weighted averages by group': 'computed',
+                                'save CSV-files': 'computed'}
+    # Other title in the CSV-files: only the files are written again
+    monkeypatch.setitem(col_titles_by_suffix, '', 'Average distance by plane per person in 2015, in km')
+    status_of_stages = get_status_of_stages()
+    assert status_of_stages.pop('compute weighted averages by group') == 'loaded'
+    assert status_of_stages.pop('save CSV-files') == 'computed'
+    assert set(status_of_stages.values()) == {None}